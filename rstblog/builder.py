@@ -12,13 +12,31 @@ from __future__ import absolute_import
 from __future__ import print_function
 import re
 import os
+import copy
 import posixpath
-from fnmatch import fnmatch
+import warnings
+import multiprocessing
+from hashlib import sha1
 from six.moves.urllib.parse import urlparse
 
+import docutils
 from docutils.core import publish_parts
-
-from jinja2 import Environment, FileSystemLoader, Markup
+from docutils.frontend import OptionParser
+from docutils.parsers.rst import Parser as RSTParser
+from docutils.readers.standalone import Reader as StandaloneReader
+from docutils.utils import DependencyList
+from docutils.writers.html4css1 import Writer as HTMLWriter
+
+import jinja2
+from jinja2 import (
+    Environment,
+    FileSystemLoader,
+    ChoiceLoader,
+    ModuleLoader,
+    FileSystemBytecodeCache,
+    TemplateNotFound,
+    Markup,
+)
 
 from babel import Locale, dates
 
@@ -32,17 +50,137 @@ from rstblog.signals import (
     before_file_built,
     after_file_prepared,
     after_file_published,
+    signal_stats,
 )
 from rstblog.modules import find_module
+from rstblog.manifest import BuildManifest
+from rstblog.cache import (
+    CACHE_FOLDER,
+    DEFAULT_FRAGMENT_CACHE_SIZE,
+    MetadataCache,
+    FragmentCache,
+)
 from rstblog.programs import RSTProgram, CopyProgram
+from rstblog.records import EntryRecord, RecordStore
+from rstblog.profiler import Profiler
+from rstblog.utils import (
+    OutputFile,
+    OutputStats,
+    PatternMatcher,
+    copy_file,
+    make_folder,
+)
 import six
 
 
 OUTPUT_FOLDER = "_build"
+#: how many contexts a streamed parallel build hands to the workers at once
+DEFAULT_STREAM_BATCH_SIZE = 200
 builtin_programs = {"rst": RSTProgram, "copy": CopyProgram}
 builtin_templates = os.path.join(os.path.dirname(__file__), "templates")
+compiled_templates = os.path.join(os.path.dirname(__file__), "compiled_templates")
+template_extensions = ["jinja2.ext.autoescape", "jinja2.ext.with_"]
 url_parts_re = re.compile(r"\$(\w+|{[^}]+})")
 
+# contexts handed to the worker processes of a parallel build.  They are
+# set right before the pool is forked so that the workers inherit them
+# together with the rest of the builder state.
+_worker_contexts = None
+
+
+def _build_in_worker(index):
+    context = _worker_contexts[index]
+    stats = context.builder.output_stats
+    stats.reset()
+    context.program.run()
+    entry = context.builder.manifest.make_entry(context)
+    return index, entry, (stats.written, stats.skipped)
+
+
+# functions handed to the worker processes by :meth:`Builder.run_jobs`.
+_worker_jobs = None
+
+
+def _run_job_in_worker(index):
+    builder, funcs = _worker_jobs
+    stats = builder.output_stats
+    stats.reset()
+    funcs[index]()
+    return stats.written, stats.skipped
+
+
+def get_fork_context():
+    """Returns a multiprocessing context that forks or `None` if the
+    platform cannot fork.  Contexts, programs and the template environment
+    are not picklable so workers have to inherit them.
+    """
+    try:
+        return multiprocessing.get_context("fork")
+    except ValueError:
+        return None
+
+
+def get_builtin_templates_stamp():
+    """Returns a hash over the builtin templates and the Jinja version.
+    Precompiled templates are only used if they were compiled for the same
+    stamp.
+    """
+    h = sha1(jinja2.__version__.encode("utf-8"))
+    loader = FileSystemLoader(builtin_templates)
+    for name in sorted(loader.list_templates()):
+        with open(os.path.join(builtin_templates, name), "rb") as f:
+            h.update(name.encode("utf-8") + b"\0" + f.read())
+    return h.hexdigest()
+
+
+def get_compiled_templates_folder(autoescape, folder=compiled_templates):
+    return os.path.join(folder, autoescape and "autoescape" or "noautoescape")
+
+
+def compile_builtin_templates(folder=compiled_templates):
+    """Compiles the builtin templates into Python modules so that builders
+    do not have to compile them on startup.  This is meant to be run once
+    after installing, for instance with ``run-rstblog precompile``.
+    """
+    for autoescape in True, False:
+        env = Environment(
+            loader=FileSystemLoader(builtin_templates),
+            autoescape=autoescape,
+            extensions=template_extensions,
+        )
+        target = get_compiled_templates_folder(autoescape, folder)
+        env.compile_templates(target, zip=None, ignore_errors=False)
+        with open(os.path.join(target, "STAMP"), "w") as f:
+            f.write(get_builtin_templates_stamp())
+
+
+class BuiltinTemplateLoader(FileSystemLoader):
+    """Loads the builtin templates.  If precompiled modules for them exist
+    in `compiled_folder` and were compiled from the same sources they are
+    used instead of compiling the templates.  The sources are still
+    available through :meth:`get_source`.
+    """
+
+    def __init__(self, compiled_folder=None):
+        FileSystemLoader.__init__(self, builtin_templates)
+        self.module_loader = None
+        if compiled_folder is not None:
+            try:
+                with open(os.path.join(compiled_folder, "STAMP")) as f:
+                    stamp = f.read().strip()
+            except IOError:
+                stamp = None
+            if stamp == get_builtin_templates_stamp():
+                self.module_loader = ModuleLoader(compiled_folder)
+
+    def load(self, environment, name, globals=None):
+        if self.module_loader is not None:
+            try:
+                return self.module_loader.load(environment, name, globals)
+            except TemplateNotFound:
+                pass
+        return FileSystemLoader.load(self, environment, name, globals)
+
 
 class Context(object):
     """Per rendering information"""
@@ -50,11 +188,17 @@ class Context(object):
     def __init__(self, builder, config, source_filename, prepare=False):
         self.builder = builder
         self.config = config
+        self.base_config = config
+        self.rendered_templates = set()
+        self.dependencies = {}
         self.title = "Untitled"
         self.summary = None
+        self.summary_html = None
         self.pub_date = None
         self.source_filename = source_filename
         self.links = []
+        self._generated_files = None
+        self._record = None
         self.program_name = self.config.get("program")
         if self.program_name is None:
             self.program_name = self.builder.guess_program(config, source_filename)
@@ -63,14 +207,15 @@ class Context(object):
             self.builder.prefix_path.lstrip("/"), self.program.get_desired_filename()
         )
         if prepare:
-            self.program.prepare()
+            with builder.profiler.span("prepare", file=source_filename):
+                self.program.prepare()
             after_file_prepared.send(self)
             if self.public:
                 after_file_published.send(self)
 
     @property
     def is_new(self):
-        return not os.path.exists(self.full_destination_filename)
+        return not self.builder.output_file_exists(self.full_destination_filename)
 
     @property
     def public(self):
@@ -85,16 +230,13 @@ class Context(object):
         return posixpath.join(directory, basename).replace("\\", "/")
 
     def make_destination_folder(self):
-        folder = self.destination_folder
-        if not os.path.isdir(folder):
-            os.makedirs(folder)
+        make_folder(self.destination_folder)
 
     def open_source_file(self, mode="rb"):
         return open(self.full_source_filename, mode)
 
     def open_destination_file(self, mode="wb"):
-        self.make_destination_folder()
-        return open(self.full_destination_filename, mode)
+        return self.builder.open_output_file(self.full_destination_filename, mode)
 
     @property
     def destination_folder(self):
@@ -116,9 +258,7 @@ class Context(object):
     def needs_build(self):
         if self.is_new:
             return True
-        src = self.full_source_filename
-        dst = self.full_destination_filename
-        return os.path.getmtime(dst) < os.path.getmtime(src)
+        return self.builder.manifest.is_stale(self)
 
     def get_default_template_context(self):
         slug = self.destination_filename
@@ -137,21 +277,63 @@ class Context(object):
         real_context = self.get_default_template_context()
         if context:
             real_context.update(context)
+        self.rendered_templates.add(template_name)
         return self.builder.render_template(template_name, real_context)
 
+    def add_dependency(self, name, *args):
+        """Records that the output depends on more than the source file
+        and the templates, for example on the recent blog entries.  `name`
+        has to be registered with :meth:`Builder.register_dependency`, the
+        manifest remembers the digest and builds the file again once it
+        changes.
+        """
+        key = (name,) + args
+        if key not in self.dependencies:
+            self.dependencies[key] = self.builder.get_dependency_digest(name, *args)
+
+    def add_generated_file(self, filename):
+        """Directives that write files while the document is rendered
+        have to register them here.  Fragments from the cache are only
+        used if all files they registered still exist.
+        """
+        if self._generated_files is not None:
+            self._generated_files.append(filename)
+
     def render_rst(self, contents):
-        settings = {
-            "initial_header_level": self.config.get("rst_header_level", 2),
-            "rstblog_context": self,
-        }
-        parts = publish_parts(
-            source=contents, writer_name="html4css1", settings_overrides=settings
+        header_level = self.config.get("rst_header_level", 2)
+        cache = self.builder.fragment_cache
+        cache_key = cache.make_key(
+            contents,
+            header_level,
+            docutils.__version__,
+            self.builder.config.get_digest(),
+            self.builder.manifest.get_module_digest(),
         )
-        return {
+        cached = cache.get(cache_key)
+        if cached is not None:
+            rv, generated_files = cached
+            if all(os.path.isfile(x) for x in generated_files):
+                return rv
+
+        settings = self.builder.get_rst_settings(
+            initial_header_level=header_level, rstblog_context=self
+        )
+        old_generated_files = self._generated_files
+        self._generated_files = generated_files = []
+        try:
+            with self.builder.profiler.span("docutils", file=self.source_filename):
+                parts = publish_parts(
+                    source=contents, writer_name="html4css1", settings=settings
+                )
+        finally:
+            self._generated_files = old_generated_files
+        rv = {
             "title": Markup(parts["title"]).striptags(),
             "html_title": Markup(parts["html_title"]),
             "fragment": Markup(parts["fragment"]),
         }
+        cache.set(cache_key, (rv, generated_files))
+        return rv
 
     def render_contents(self):
         return self.program.render_contents()
@@ -159,7 +341,19 @@ class Context(object):
     def render_summary(self):
         if not self.summary:
             return ""
-        return self.render_rst(self.summary)["fragment"]
+        if self.summary_html is None:
+            self.summary_html = self.render_rst(self.summary)["fragment"]
+        return self.summary_html
+
+    def get_record(self):
+        """Returns the :class:`EntryRecord` of this context.  Modules that
+        collect published files keep the record instead of the context so
+        that the context can be released once it was built.
+        """
+        if self._record is None:
+            self._record = EntryRecord.from_context(self)
+            self.builder.records.add(self._record)
+        return self._record
 
     def add_stylesheet(self, href, type=None, media=None):
         if type is None:
@@ -181,6 +375,7 @@ class Context(object):
     def build(self):
         before_file_built.send(self)
         self.program.run()
+        self.builder.manifest.record(self)
 
 
 class BuildError(ValueError):
@@ -206,6 +401,30 @@ class Builder(object):
         self.programs = builtin_programs.copy()
         self.modules = []
         self.storage = {}
+        self.dependency_handlers = {}
+        self.files_prepared = False
+        self.jobs = 1
+        self.profiler = Profiler()
+        self.output_stats = OutputStats()
+        self._matchers = {}
+        self._source_entries = {}
+        self._output_files = None
+        self._folder_configs = {}
+        self._rst_settings = None
+        self.manifest = BuildManifest(self)
+        self.records = RecordStore(
+            self, os.path.join(self.cache_folder, "records.pickle")
+        )
+        self.metadata_cache = MetadataCache(
+            os.path.join(self.cache_folder, "metadata.pickle")
+        )
+        fragment_cache_size = self.config.root_get(
+            "fragment_cache_size", DEFAULT_FRAGMENT_CACHE_SIZE
+        )
+        self.fragment_cache = FragmentCache(
+            os.path.join(self.cache_folder, "fragments"),
+            int(fragment_cache_size * 1024 * 1024),
+        )
         self.url_map = Map()
         parsed = urlparse(self.config.root_get("canonical_url"))
         self.prefix_path = parsed.path
@@ -219,10 +438,25 @@ class Builder(object):
             self.config.root_get("template_path") or self.default_template_path,
         )
         self.locale = Locale(self.config.root_get("locale") or "en")
+        autoescape = self.config.root_get("template_autoescape", True)
+        bytecode_cache = None
+        if self.config.root_get("template_bytecode_cache", True):
+            bytecode_cache_folder = os.path.join(self.cache_folder, "jinja")
+            if not os.path.isdir(bytecode_cache_folder):
+                os.makedirs(bytecode_cache_folder)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_folder)
         self.jinja_env = Environment(
-            loader=FileSystemLoader([template_path, builtin_templates]),
-            autoescape=self.config.root_get("template_autoescape", True),
-            extensions=["jinja2.ext.autoescape", "jinja2.ext.with_"],
+            loader=ChoiceLoader(
+                [
+                    FileSystemLoader(template_path),
+                    BuiltinTemplateLoader(
+                        get_compiled_templates_folder(autoescape)
+                    ),
+                ]
+            ),
+            autoescape=autoescape,
+            extensions=template_extensions,
+            bytecode_cache=bytecode_cache,
         )
         self.jinja_env.globals.update(
             link_to=self.link_to,
@@ -246,6 +480,12 @@ class Builder(object):
             self.project_folder, self.config.root_get("output_folder") or OUTPUT_FOLDER
         )
 
+    @property
+    def cache_folder(self):
+        return os.path.join(
+            self.project_folder, self.config.root_get("cache_folder") or CACHE_FOLDER
+        )
+
     def link_to(self, _key, **values):
         return self.url_adapter.build(_key, values)
 
@@ -255,12 +495,23 @@ class Builder(object):
             link += "index.html"
         return os.path.join(self.default_output_folder, link)
 
+    def open_output_file(self, filename, mode="wb"):
+        """Opens a file in the output folder.  Files opened for writing are
+        only replaced once they are closed and only if their contents
+        changed.
+        """
+        if not mode.startswith("w"):
+            make_folder(os.path.dirname(filename))
+            return open(filename, mode)
+        return OutputFile(filename, mode, self.output_stats)
+
+    def copy_output_file(self, source, destination):
+        """Copies a file into the output folder unless it is unchanged."""
+        return copy_file(source, destination, self.output_stats)
+
     def open_link_file(self, _key, mode="wb", **values):
         filename = self.get_link_filename(_key, **values)
-        folder = os.path.dirname(filename)
-        if not os.path.isdir(folder):
-            os.makedirs(folder)
-        return open(filename, mode)
+        return self.open_output_file(filename, mode)
 
     def register_url(
         self, key, rule=None, config_key=None, config_default=None, **extra
@@ -269,6 +520,19 @@ class Builder(object):
             rule = self.config.root_get(config_key, config_default)
         self.url_map.add(Rule(rule, endpoint=key, **extra))
 
+    def register_dependency(self, name, func):
+        """Registers a function that returns a digest of something outputs
+        can depend on, see :meth:`Context.add_dependency`.  It is called
+        with the builder and the arguments given to the context.
+        """
+        self.dependency_handlers[name] = func
+
+    def get_dependency_digest(self, name, *args):
+        func = self.dependency_handlers.get(name)
+        if func is None:
+            return None
+        return func(self, *args)
+
     def get_full_static_filename(self, filename):
         return os.path.join(self.default_output_folder, self.static_folder, filename)
 
@@ -277,33 +541,55 @@ class Builder(object):
 
     def open_static_file(self, filename, mode="w"):
         full_filename = self.get_full_static_filename(filename)
-        folder = os.path.dirname(full_filename)
-        if not os.path.isdir(folder):
-            os.makedirs(folder)
-        return open(full_filename, mode)
+        return self.open_output_file(full_filename, mode)
+
+    def get_rst_settings(self, **overrides):
+        """Returns a fresh copy of the docutils settings with the given
+        overrides applied.  Computing the defaults means setting up an
+        option parser for all docutils components and reading the docutils
+        config files which is more expensive than parsing a short document,
+        so it only happens once per builder.
+        """
+        if self._rst_settings is None:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                parser = OptionParser(
+                    components=(StandaloneReader, RSTParser, HTMLWriter),
+                    read_config_files=True,
+                )
+            self._rst_settings = parser.get_default_values()
+        settings = copy.copy(self._rst_settings)
+        settings.record_dependencies = DependencyList()
+        settings.__dict__.update(overrides)
+        return settings
 
     def get_storage(self, module):
         return self.storage.setdefault(module, {})
 
+    def get_pattern_matcher(self, patterns):
+        """Returns a :class:`PatternMatcher` for the given patterns.  The
+        matchers and the decisions they cached are kept for the lifetime of
+        the builder.
+        """
+        patterns = tuple(patterns)
+        rv = self._matchers.get(patterns)
+        if rv is None:
+            rv = self._matchers[patterns] = PatternMatcher(patterns)
+        return rv
+
     def filter_files(self, files, config):
         patterns = config.merged_get("ignore_files")
         if patterns is None:
             patterns = self.default_ignores
-
-        result = []
-        for filename in files:
-            for pattern in patterns:
-                if fnmatch(filename, pattern):
-                    break
-            else:
-                result.append(filename)
-        return result
+        matcher = self.get_pattern_matcher(patterns)
+        return [x for x in files if matcher.match(x) is None]
 
     def guess_program(self, config, filename):
         mapping = config.list_entries("programs") or self.default_programs
-        for pattern, program_name in six.iteritems(mapping):
-            if fnmatch(filename, pattern):
-                return program_name
+        patterns, program_names = zip(*six.iteritems(mapping))
+        idx = self.get_pattern_matcher(patterns).match(filename)
+        if idx is not None:
+            return program_names[idx]
         return "copy"
 
     def render_template(self, template_name, context=None):
@@ -311,9 +597,10 @@ class Builder(object):
             context = {}
         context["builder"] = self
         context.setdefault("config", self.config)
-        tmpl = self.jinja_env.get_template(template_name)
-        before_template_rendered.send(tmpl, context=context)
-        return tmpl.render(context)
+        with self.profiler.span("render", template_name):
+            tmpl = self.jinja_env.get_template(template_name)
+            before_template_rendered.send(tmpl, context=context)
+            return tmpl.render(context)
 
     def format_datetime(self, datetime=None, format="medium"):
         return dates.format_datetime(datetime, format, locale=self.locale)
@@ -324,44 +611,287 @@ class Builder(object):
     def format_date(self, date=None, format="medium"):
         return dates.format_date(date, format, locale=self.locale)
 
+    def scan_folder(self, folder):
+        """Walks a folder like :func:`os.walk` but yields the
+        :class:`os.DirEntry` objects of the folders and files, so the stat
+        results they cache can be reused.  Removing entries from the list
+        of folders prevents the walk from descending into them.
+        """
+        dirs = []
+        files = []
+        try:
+            it = os.scandir(folder)
+        except OSError:
+            return
+        try:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                (dirs if is_dir else files).append(entry)
+        finally:
+            if hasattr(it, "close"):
+                it.close()
+        yield folder, dirs, files
+        for entry in dirs:
+            if not entry.is_symlink():
+                for item in self.scan_folder(entry.path):
+                    yield item
+
+    def get_source_stat(self, filename):
+        """Returns the stat result for a source file, from the last scan
+        if the file was seen there.
+        """
+        entry = self._source_entries.get(filename)
+        if entry is not None:
+            return entry.stat()
+        return os.stat(filename)
+
+    def output_file_exists(self, filename):
+        """Checks if a file exists in the output folder.  The whole output
+        folder is listed once per scan instead of checking files one by
+        one.
+        """
+        folder = self.default_output_folder
+        if not filename.startswith(folder + os.path.sep):
+            return os.path.exists(filename)
+        if self._output_files is None:
+            self._output_files = set()
+            for dirpath, dirs, files in self.scan_folder(folder):
+                self._output_files.update(x.path for x in files)
+        return filename in self._output_files
+
+    def get_folder_config(self, folder):
+        """Returns the config for the files in a folder that is given
+        relative to the project folder.
+        """
+        rv = self._folder_configs.get(folder)
+        if rv is None:
+            rv = self.config
+            filename = os.path.join(self.project_folder, folder, "config.yml")
+            if os.path.isfile(filename):
+                with open(filename) as f:
+                    rv = rv.add_from_file(f)
+            self._folder_configs[folder] = rv
+        return rv
+
     def iter_contexts(self, prepare=True):
+        # modules check this to tell whether they saw all published files
+        # or have to fall back to the records of the last build.  What they
+        # derived from those records is dropped for every new check.
+        self.files_prepared = prepare
+        if not prepare:
+            self.storage.clear()
+        self._source_entries = {}
+        self._output_files = None
+        self._folder_configs = {}
         last_config = self.config
         cutoff = len(self.project_folder) + 1
-        for dirpath, dirnames, filenames in os.walk(self.project_folder):
+        for dirpath, dirs, files in self.scan_folder(self.project_folder):
             local_config = last_config
-            local_config_filename = os.path.join(dirpath, "config.yml")
-            if os.path.isfile(local_config_filename):
-                with open(local_config_filename) as f:
+            if any(x.name == "config.yml" for x in files):
+                with open(os.path.join(dirpath, "config.yml")) as f:
                     local_config = last_config.add_from_file(f)
+            self._folder_configs[dirpath[cutoff:]] = local_config
 
-            dirnames[:] = self.filter_files(dirnames, local_config)
-            filenames = self.filter_files(filenames, local_config)
+            keep = set(self.filter_files([x.name for x in dirs], local_config))
+            dirs[:] = [x for x in dirs if x.name in keep]
+            keep = set(self.filter_files([x.name for x in files], local_config))
 
-            for filename in filenames:
+            for entry in files:
+                if entry.name not in keep:
+                    continue
+                self._source_entries[entry.path] = entry
                 yield Context(
                     self,
                     local_config,
-                    os.path.join(dirpath[cutoff:], filename),
+                    os.path.join(dirpath[cutoff:], entry.name),
                     prepare,
                 )
 
     def anything_needs_build(self):
+        self.manifest.reset_caches()
         for context in self.iter_contexts(prepare=False):
             if context.needs_build:
                 return True
         return False
 
-    def run(self):
+    def iter_streamed_contexts(self):
+        """Like :meth:`iter_contexts` but without keeping the contexts
+        alive.  The first pass prepares every file so that the modules see
+        all published files before anything is rendered, but only remembers
+        the files.  Which of them need a build is only checked after that
+        as outputs can depend on other files.  Those are prepared again and
+        yielded one by one in the second pass.  No signals are sent for
+        them a second time, what the modules set on the contexts is taken
+        from their records instead, see :meth:`EntryRecord.restore`.
+        """
+        with self.profiler.span("scan"):
+            files = [
+                (context.base_config, context.source_filename)
+                for context in self.iter_contexts()
+            ]
+            pending = [x for x in files if Context(self, *x).needs_build]
+        for config, source_filename in pending:
+            context = Context(self, config, source_filename)
+            with self.profiler.span("prepare", file=source_filename):
+                context.program.prepare()
+            record = self.records.get(source_filename)
+            if record is not None:
+                record.restore(context)
+            yield context
+
+    def run(self, jobs=1, stream=False, profile=False):
+        """Builds the project.  With `stream` the contexts are not kept
+        in memory for the whole build, see :meth:`iter_streamed_contexts`.
+        Parallel streamed builds hand them to the workers in batches of
+        ``stream_batch_size`` contexts.
+        With `profile` the build runs in a single process and the time
+        spent in every phase is reported at the end, see
+        :class:`~rstblog.profiler.Profiler`.
+        """
+        self.profiler = Profiler(enabled=profile)
+        if profile:
+            jobs = 1
+        self.jobs = jobs
+        signal_stats.reset()
         self.storage.clear()
-        contexts = list(self.iter_contexts())
-
+        self.records.reset()
+        self.output_stats.reset()
+        self.manifest.reset_caches()
+        if stream:
+            contexts = self.iter_streamed_contexts()
+        else:
+            with self.profiler.span("scan"):
+                contexts = list(self.iter_contexts())
+
+        mp_context = get_fork_context()
+        if jobs > 1 and mp_context is not None:
+            batch_size = None
+            if stream:
+                batch_size = int(
+                    self.config.root_get(
+                        "stream_batch_size", DEFAULT_STREAM_BATCH_SIZE
+                    )
+                )
+            self.build_parallel(contexts, jobs, mp_context, batch_size)
+        else:
+            for context in contexts:
+                if context.needs_build:
+                    key = context.is_new and "A" or "U"
+                    with self.profiler.span("build", file=context.source_filename):
+                        context.run()
+                    print(key, context.source_filename)
+
+        self.profiler.send(before_build_finished, self, "finish")
+        self.manifest.save()
+        self.records.save()
+        self.metadata_cache.save()
+        self.fragment_cache.prune()
+        print(self.output_stats)
+        if profile:
+            self.report_profile()
+        self.dump_signal_stats(verbose=profile)
+
+    def dump_signal_stats(self, verbose=False):
+        """Writes the call counts and timings of the signal receivers of
+        the build to ``signals.json`` in the cache folder, and prints them
+        if `verbose` is set.  The same data is available from
+        :data:`rstblog.signals.signal_stats` while the builder runs.
+        """
+        if not signal_stats.enabled:
+            return
+        if not os.path.isdir(self.cache_folder):
+            os.makedirs(self.cache_folder)
+        signal_stats.write_json(os.path.join(self.cache_folder, "signals.json"))
+        if verbose:
+            print()
+            print(signal_stats.format_report())
+
+    def report_profile(self):
+        """Prints the report of the profiler and writes the JSON and trace
+        files into the cache folder.
+        """
+        print()
+        print(self.profiler.format_report())
+        for filename in self.profiler.write_reports(
+            os.path.join(self.cache_folder, "profile")
+        ):
+            print("Wrote", filename)
+
+    def build_parallel(self, contexts, jobs, mp_context, batch_size=None):
+        """Builds the given contexts on a pool of `jobs` worker processes.
+        All signals are sent in this process before the work is handed out,
+        so modules see the same sequence of events as in a serial build and
+        everything they remember ends up in this builder's storage.  Only
+        the rendering and writing of the output happens in the workers.
+
+        With a `batch_size` the contexts are built in batches of at most
+        that many, each on a freshly forked pool, so that a streamed build
+        does not keep all contexts alive at once.
+        """
+        pending = []
         for context in contexts:
             if context.needs_build:
-                key = context.is_new and "A" or "U"
-                context.run()
-                print(key, context.source_filename)
-
-        before_build_finished.send(self)
+                before_file_processed.send(context)
+                before_file_built.send(context)
+                pending.append((context, context.is_new and "A" or "U"))
+                if batch_size is not None and len(pending) >= batch_size:
+                    self.build_batch(pending, jobs, mp_context)
+                    pending = []
+        if pending:
+            self.build_batch(pending, jobs, mp_context)
+
+    def build_batch(self, pending, jobs, mp_context):
+        """Builds a list of ``(context, key)`` tuples on a pool of worker
+        processes, see :meth:`build_parallel`.
+        """
+        global _worker_contexts
+        _worker_contexts = [context for context, key in pending]
+        try:
+            pool = mp_context.Pool(min(jobs, len(pending)))
+            try:
+                results = pool.imap_unordered(_build_in_worker, range(len(pending)))
+                for index, entry, (written, skipped) in results:
+                    context, key = pending[index]
+                    self.manifest.record(context, entry)
+                    self.output_stats.written += written
+                    self.output_stats.skipped += skipped
+                    print(key, context.source_filename)
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            _worker_contexts = None
+
+    def run_jobs(self, funcs):
+        """Calls the given functions.  If the build runs with more than one
+        job they are called on a pool of worker processes.  The workers are
+        forked so the functions do not have to be picklable, but everything
+        they change except for the files they write is lost.
+        """
+        global _worker_jobs
+        funcs = list(funcs)
+        mp_context = get_fork_context()
+        if self.jobs <= 1 or len(funcs) <= 1 or mp_context is None:
+            for func in funcs:
+                func()
+            return
+
+        _worker_jobs = (self, funcs)
+        try:
+            pool = mp_context.Pool(min(self.jobs, len(funcs)))
+            try:
+                results = pool.imap_unordered(_run_job_in_worker, range(len(funcs)))
+                for written, skipped in results:
+                    self.output_stats.written += written
+                    self.output_stats.skipped += skipped
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            _worker_jobs = None
 
     def debug_serve(self, host="0.0.0.0", port=5000):
         from rstblog.server import Server
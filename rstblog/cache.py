@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+    rstblog.cache
+    ~~~~~~~~~~~~~
+
+    On-disk caches that survive between builds.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+from __future__ import absolute_import
+import os
+import tempfile
+from hashlib import sha1
+import six
+from six.moves import cPickle as pickle
+
+from rstblog.utils import make_folder
+
+
+CACHE_FOLDER = '_cache'
+
+#: the default size limit of the fragment cache in megabytes
+DEFAULT_FRAGMENT_CACHE_SIZE = 100
+
+
+def write_pickle(filename, obj):
+    """Atomically replaces the given file with a pickle of `obj`."""
+    folder = os.path.dirname(filename)
+    make_folder(folder)
+    fd, tmp_filename = tempfile.mkstemp(dir=folder, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filename, filename)
+    except:
+        os.remove(tmp_filename)
+        raise
+
+
+def read_pickle(filename, default=None):
+    try:
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+    except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return default
+
+
+class MetadataCache(object):
+    """Remembers what a program extracted from a source file when it was
+    prepared.  Entries are stored with the stat result of the file and only
+    returned if its mtime and size still match, so unchanged files do not
+    have to be opened again.  Entries that were not used during a build are
+    dropped when the cache is saved.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = None
+        self.used = set()
+
+    def get(self, key, stat):
+        if self.entries is None:
+            self.entries = read_pickle(self.filename, {})
+        item = self.entries.get(key)
+        if item is None or item[0] != (stat.st_mtime, stat.st_size):
+            return None
+        self.used.add(key)
+        return item[1]
+
+    def set(self, key, stat, data):
+        if self.entries is None:
+            self.entries = read_pickle(self.filename, {})
+        self.entries[key] = ((stat.st_mtime, stat.st_size), data)
+        self.used.add(key)
+
+    def save(self):
+        if self.entries is None:
+            return
+        for key in set(self.entries) - self.used:
+            del self.entries[key]
+        write_pickle(self.filename, self.entries)
+        self.used = set()
+
+
+class FragmentCache(object):
+    """A content addressed cache of rendered HTML fragments.  Every item
+    is stored in its own file and the modification time of that file is
+    bumped whenever it is used, so that :meth:`prune` can evict the least
+    recently used items once the cache grows over `max_size` bytes.
+    A `max_size` of zero disables the cache.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def make_key(self, *parts):
+        h = sha1()
+        for part in parts:
+            if not isinstance(part, bytes):
+                part = six.text_type(part).encode('utf-8')
+            h.update(part + b'\0')
+        return h.hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.folder, key[:2], key[2:])
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        filename = self.get_filename(key)
+        rv = read_pickle(filename)
+        if rv is not None:
+            try:
+                os.utime(filename, None)
+            except OSError:
+                pass
+        return rv
+
+    def set(self, key, data):
+        if self.enabled:
+            write_pickle(self.get_filename(key), data)
+
+    def prune(self):
+        """Evicts the least recently used items until the cache fits into
+        its size limit again.
+        """
+        if not self.enabled or not os.path.isdir(self.folder):
+            return
+        items = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.folder):
+            for filename in filenames:
+                filename = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                items.append((stat.st_mtime, stat.st_size, filename))
+                total += stat.st_size
+        items.sort()
+        for mtime, size, filename in items:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            total -= size
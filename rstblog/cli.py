@@ -13,8 +13,9 @@ from __future__ import absolute_import
 from __future__ import print_function
 import sys
 import os
+from optparse import OptionParser
 from rstblog.config import Config
-from rstblog.builder import Builder
+from rstblog.builder import Builder, compile_builtin_templates
 
 
 def get_builder(project_folder):
@@ -28,16 +29,38 @@ def get_builder(project_folder):
     return Builder(project_folder, config)
 
 
+def get_option_parser():
+    parser = OptionParser(usage='%prog [options] [<action> [<folder>]]',
+                          description='Actions are build, serve and '
+                                      'precompile.  The folder defaults to '
+                                      'the current one.')
+    parser.add_option('-j', '--jobs', type='int', default=1, metavar='N',
+                      help='build the files on N worker processes')
+    parser.add_option('--stream', action='store_true', default=False,
+                      help='do not keep the files in memory for the whole '
+                           'build')
+    parser.add_option('--profile', action='store_true', default=False,
+                      help='report how long the phases of the build take')
+    return parser
+
+
 def main():
     """Entrypoint for the console script."""
-    if len(sys.argv) not in (1, 2, 3):
-        print('usage: rstblog <action> <folder>', file=sys.stderr)
-    if len(sys.argv) >= 2:
-        action = sys.argv[1]
+    parser = get_option_parser()
+    options, args = parser.parse_args()
+    if options.jobs < 1:
+        parser.error('--jobs has to be at least 1')
+    if len(args) > 2:
+        parser.print_usage(sys.stderr)
+    if len(args) >= 1:
+        action = args[0]
     else:
         action = 'build'
-    if len(sys.argv) >= 3:
-        folder = sys.argv[2]
+    if action == 'precompile':
+        compile_builtin_templates()
+        return
+    if len(args) >= 2:
+        folder = args[1]
     else:
         folder = os.getcwd()
     if action not in ('build', 'serve'):
@@ -45,6 +68,7 @@ def main():
     builder = get_builder(folder)
 
     if action == 'build':
-        builder.run()
+        builder.run(jobs=options.jobs, stream=options.stream,
+                    profile=options.profile)
     else:
         builder.debug_serve()
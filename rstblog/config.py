@@ -9,6 +9,8 @@
     :license: BSD, see LICENSE for more details.
 """
 from __future__ import absolute_import
+import json
+from hashlib import sha1
 import yaml
 import six
 
@@ -17,17 +19,42 @@ missing = object()
 
 
 class Config(object):
-    """A stacked config."""
+    """A stacked config.  Lookups go through a flattened view of all layers
+    that is built the first time it is needed, so layers must not be
+    modified once they were added.
+    """
 
     def __init__(self):
         self.stack = []
+        self._parent = None
+        self._reset()
+
+    def _reset(self):
+        self._flat = None
+        self._prefix_index = None
+        self._merged = {}
+        self._digest = None
+
+    def get_flat(self):
+        """Returns a dict with the values of all layers merged.  It is
+        shared and must not be modified.
+        """
+        if self._flat is None:
+            parent = self._parent
+            if parent is not None and \
+               len(parent.stack) + 1 == len(self.stack) and \
+               all(a is b for a, b in zip(parent.stack, self.stack)):
+                flat = dict(parent.get_flat())
+                flat.update(self.stack[-1])
+            else:
+                flat = {}
+                for layer in self.stack:
+                    flat.update(layer)
+            self._flat = flat
+        return self._flat
 
     def __getitem__(self, key):
-        for layer in reversed(self.stack):
-            rv = layer.get(key, missing)
-            if rv is not missing:
-                return rv
-        raise KeyError(key)
+        return self.get_flat()[key]
 
     def get(self, key, default=None):
         try:
@@ -36,30 +63,50 @@ class Config(object):
             return default
 
     def list_entries(self, key):
-        rv = {}
-        prefix = key + '.'
-        for layer in self.stack:
-            for key, value in six.iteritems(layer):
-                if key.startswith(prefix):
-                    rv[key] = value
-        return rv
+        if self._prefix_index is None:
+            index = {}
+            for name, value in six.iteritems(self.get_flat()):
+                parts = name.split('.')
+                for idx in range(1, len(parts)):
+                    index.setdefault('.'.join(parts[:idx]), {})[name] = value
+            self._prefix_index = index
+        return dict(self._prefix_index.get(key, ()))
 
     def merged_get(self, key):
-        result = None
-        for layer in reversed(self.stack):
-            rv = layer.get(key, missing)
-            if rv is not missing:
+        """Merges the lists or dicts stored for `key` in all layers,
+        starting with the topmost one.  The layers themselves are left
+        alone and the result is cached, a fresh copy of it is returned on
+        every call.
+        """
+        result = self._merged.get(key, missing)
+        if result is missing:
+            result = None
+            for layer in reversed(self.stack):
+                rv = layer.get(key, missing)
+                if rv is missing:
+                    continue
                 if result is None:
+                    if isinstance(rv, (list, dict)):
+                        rv = type(rv)(rv)
                     result = rv
+                elif isinstance(result, list):
+                    result.extend(rv)
+                elif isinstance(result, dict):
+                    result.update(rv)
                 else:
-                    if isinstance(result, list):
-                        result.extend(rv)
-                    elif isinstance(result, dict):
-                        result.update(rv)
-                    else:
-                        raise ValueError('expected list or dict')
+                    raise ValueError('expected list or dict')
+            self._merged[key] = result
+        if isinstance(result, (list, dict)):
+            return type(result)(result)
         return result
 
+    def get_digest(self):
+        """Returns a hash over all layers of the config."""
+        if self._digest is None:
+            data = json.dumps(self.stack, sort_keys=True, default=repr)
+            self._digest = sha1(data.encode('utf-8')).hexdigest()
+        return self._digest
+
     def root_get(self, key, default=None):
         return self.stack[0].get(key, default)
 
@@ -70,6 +117,7 @@ class Config(object):
         layer = {}
         rv = Config()
         rv.stack = self.stack + [layer]
+        rv._parent = self
         def _walk(d, prefix):
             for key, value in six.iteritems(d):
                 if isinstance(value, dict):
@@ -92,3 +140,5 @@ class Config(object):
 
     def pop(self):
         self.stack.pop()
+        self._parent = None
+        self._reset()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+    rstblog.feeds
+    ~~~~~~~~~~~~~
+
+    Feed writers that write every entry to the file as soon as it is
+    added, so that even feeds with the whole history of a blog never have
+    more than one entry in memory.  Atom (:rfc:`4287`) and JSON Feed are
+    supported, as well as the paged and archived feeds of :rfc:`5005`.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+import json
+from datetime import datetime
+
+from werkzeug import escape as _escape
+import six
+
+
+ATOM_NAMESPACE = 'http://www.w3.org/2005/Atom'
+HISTORY_NAMESPACE = 'http://purl.org/syndication/history/1.0'
+JSON_FEED_VERSION = 'https://jsonfeed.org/version/1.1'
+
+
+def escape(value):
+    """Escapes a value for XML.  Unlike the Werkzeug function this also
+    escapes markup objects, the HTML of the entries has to end up as text.
+    """
+    if value is None:
+        return u''
+    return _escape(six.text_type(value))
+
+
+def format_iso8601(obj):
+    rv = obj.isoformat()
+    if obj.tzinfo:
+        return rv
+    return rv + 'Z'
+
+
+class FeedWriter(object):
+    """Base class of the feed writers.  The header is written when the
+    first entry is added and :meth:`close` finishes the feed, the file
+    itself is left open.
+
+    `updated` should be the newest date of the entries, as the header is
+    written before they are known.  `links` maps link relations like
+    ``'next'`` or ``'prev-archive'`` to URLs.  A feed that contains every
+    entry there is should be marked as `complete`, one that is part of an
+    archive as `archive`.
+    """
+
+    def __init__(self, f, title, url, feed_url, subtitle=None,
+                 updated=None, links=None, complete=False, archive=False):
+        self.f = f
+        self.title = title
+        self.url = url
+        self.feed_url = feed_url
+        self.subtitle = subtitle
+        self.updated = updated or datetime.utcnow()
+        self.links = links or {}
+        self.complete = complete
+        self.archive = archive
+        self.count = 0
+
+    def write(self, text):
+        self.f.write(text.encode('utf-8'))
+
+    def add(self, title, content, url, updated, author=None, id=None):
+        if not self.count:
+            self.write_header()
+        self.write_entry(title, content, url, updated, author, id or url)
+        self.count += 1
+
+    def close(self):
+        if not self.count:
+            self.write_header()
+        self.write_footer()
+
+    def write_header(self):
+        raise NotImplementedError()
+
+    def write_entry(self, title, content, url, updated, author, id):
+        raise NotImplementedError()
+
+    def write_footer(self):
+        raise NotImplementedError()
+
+
+class AtomFeedWriter(FeedWriter):
+    """Writes Atom feeds in the same layout as the Werkzeug
+    :class:`~werkzeug.contrib.atom.AtomFeed` that was used before.
+    """
+
+    def write_header(self):
+        self.write(u'<?xml version="1.0" encoding="utf-8"?>\n')
+        if self.complete or self.archive:
+            self.write(u'<feed xmlns="%s" xmlns:fh="%s">\n'
+                       % (ATOM_NAMESPACE, HISTORY_NAMESPACE))
+        else:
+            self.write(u'<feed xmlns="%s">\n' % ATOM_NAMESPACE)
+        self.write(u'  <title type="text">%s</title>\n' % escape(self.title))
+        self.write(u'  <id>%s</id>\n' % escape(self.feed_url))
+        self.write(u'  <updated>%s</updated>\n'
+                   % format_iso8601(self.updated))
+        if self.url:
+            self.write(u'  <link href="%s" />\n' % escape(self.url))
+        self.write(u'  <link href="%s" rel="self" />\n'
+                   % escape(self.feed_url))
+        for rel, href in sorted(self.links.items()):
+            self.write(u'  <link href="%s" rel="%s" />\n'
+                       % (escape(href), escape(rel)))
+        if self.subtitle:
+            self.write(u'  <subtitle type="text">%s</subtitle>\n'
+                       % escape(self.subtitle))
+        self.write(u'  <generator>rstblog</generator>\n')
+        if self.complete:
+            self.write(u'  <fh:complete/>\n')
+        if self.archive:
+            self.write(u'  <fh:archive/>\n')
+
+    def write_entry(self, title, content, url, updated, author, id):
+        self.write(u'  <entry xml:base="%s">\n' % escape(self.feed_url))
+        self.write(u'    <title type="text">%s</title>\n' % escape(title))
+        self.write(u'    <id>%s</id>\n' % escape(id))
+        self.write(u'    <updated>%s</updated>\n' % format_iso8601(updated))
+        self.write(u'    <link href="%s" />\n' % escape(url))
+        if author:
+            self.write(u'    <author>\n      <name>%s</name>\n    </author>\n'
+                       % escape(author))
+        if content:
+            self.write(u'    <content type="html">%s</content>\n'
+                       % escape(content))
+        self.write(u'  </entry>\n')
+
+    def write_footer(self):
+        self.write(u'</feed>\n')
+
+
+class JSONFeedWriter(FeedWriter):
+    """Writes feeds in the JSON Feed format.  The only paging link JSON
+    Feed knows is ``next_url``, the :rfc:`5005` relations are kept in a
+    ``_history`` extension object.
+    """
+
+    def write_header(self):
+        header = {
+            'version':          JSON_FEED_VERSION,
+            'title':            self.title,
+            'feed_url':         self.feed_url
+        }
+        if self.url:
+            header['home_page_url'] = self.url
+        if self.subtitle:
+            header['description'] = self.subtitle
+        next_url = self.links.get('next') or self.links.get('prev-archive')
+        if next_url:
+            header['next_url'] = next_url
+        history = dict(self.links)
+        if self.complete:
+            history['complete'] = True
+        if self.archive:
+            history['archive'] = True
+        if history:
+            header['_history'] = history
+        # the items are streamed into the open list at the end
+        self.write(json.dumps(header, sort_keys=True)[:-1] + ', "items": [')
+
+    def write_entry(self, title, content, url, updated, author, id):
+        item = {
+            'id':               id,
+            'url':              url,
+            'title':            six.text_type(title),
+            'content_html':     six.text_type(content or u''),
+            'date_published':   format_iso8601(updated)
+        }
+        if author:
+            item['authors'] = [{'name': author}]
+        self.write((self.count and u',\n' or u'\n') +
+                   json.dumps(item, sort_keys=True))
+
+    def write_footer(self):
+        self.write(u'\n]}\n')
+
+
+feed_writers = {
+    'atom': AtomFeedWriter,
+    'json': JSONFeedWriter
+}
+
+
+def get_feed_writer(format):
+    """Returns the feed writer class for a format name."""
+    rv = feed_writers.get(format)
+    if rv is None:
+        raise ValueError('unknown feed format "%s"' % format)
+    return rv
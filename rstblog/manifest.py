@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+    rstblog.manifest
+    ~~~~~~~~~~~~~~~~
+
+    Remembers what every output file was built from so that the builder
+    can tell exactly which outputs went stale.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+from __future__ import absolute_import
+import os
+import json
+from hashlib import sha1
+
+from jinja2 import TemplateNotFound, meta
+
+
+MANIFEST_FILENAME = '.rstblog-manifest'
+
+#: bump this if the layout of the entries changes.  Manifests with a
+#: different version are ignored which rebuilds everything once.
+MANIFEST_VERSION = 2
+
+
+def hash_bytes(data):
+    return sha1(data).hexdigest()
+
+
+def hash_file(filename):
+    h = sha1()
+    with open(filename, 'rb') as f:
+        while 1:
+            chunk = f.read(65536)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BuildManifest(object):
+    """The persistent record of the last build.  For every output the
+    manifest stores the hash of the source file, the digests of the
+    templates that were rendered (including everything they extend,
+    include or import), the digest of the config layers, the digest of
+    the active modules and the digests of the other dependencies that were
+    recorded while the output was built.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.entries = None
+        self.reset_caches()
+
+    @property
+    def filename(self):
+        return os.path.join(self.builder.default_output_folder,
+                            MANIFEST_FILENAME)
+
+    def reset_caches(self):
+        """Forgets the digests of templates and modules.  The builder
+        calls this before it checks the tree so that changes made in the
+        meantime are picked up.
+        """
+        self._template_digests = {}
+        self._module_digest = None
+
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self.entries = data.get('entries') or {}
+
+    def save(self):
+        if self.entries is None:
+            return
+        folder = os.path.dirname(self.filename)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION,
+                       'entries': self.entries}, f, sort_keys=True)
+        os.rename(tmp_filename, self.filename)
+
+    def get_entry(self, context):
+        if self.entries is None:
+            self.load()
+        return self.entries.get(context.destination_filename)
+
+    def get_dependency_args(self, name):
+        """Returns a set of the argument tuples a dependency was recorded
+        with by any of the outputs.
+        """
+        if self.entries is None:
+            self.load()
+        rv = set()
+        for entry in self.entries.values():
+            for key, digest in entry['dependencies']:
+                if key[0] == name:
+                    rv.add(tuple(key[1:]))
+        return rv
+
+    def get_module_digest(self):
+        if self._module_digest is None:
+            h = sha1()
+            for module in self.builder.modules:
+                h.update(module.__name__.encode('utf-8') + b'\0')
+                version = getattr(module, '__version__', None)
+                if version is not None:
+                    h.update(str(version).encode('utf-8'))
+                filename = getattr(module, '__file__', None)
+                if filename and filename.endswith(('.pyc', '.pyo')):
+                    filename = filename[:-1]
+                if filename and os.path.isfile(filename):
+                    h.update(hash_file(filename).encode('ascii'))
+                h.update(b'\0')
+            self._module_digest = h.hexdigest()
+        return self._module_digest
+
+    def get_template_digest(self, template_name):
+        """Returns a digest over the source of the given template and of
+        every template it references by a constant name.
+        """
+        rv = self._template_digests.get(template_name)
+        if rv is not None:
+            return rv
+        env = self.builder.jinja_env
+        seen = set()
+        pending = [template_name]
+        sources = []
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            try:
+                source = env.loader.get_source(env, name)[0]
+            except TemplateNotFound:
+                sources.append((name, None))
+                continue
+            sources.append((name, hash_bytes(source.encode('utf-8'))))
+            for ref in meta.find_referenced_templates(env.parse(source)):
+                if ref is not None:
+                    pending.append(ref)
+        rv = hash_bytes(json.dumps(sorted(sources)).encode('utf-8'))
+        self._template_digests[template_name] = rv
+        return rv
+
+    def make_entry(self, context):
+        """Creates the manifest entry for a context that was just built."""
+        filename = context.full_source_filename
+        stat = self.builder.get_source_stat(filename)
+        return {
+            'source_mtime': stat.st_mtime,
+            'source_size': stat.st_size,
+            'source_hash': hash_file(filename),
+            'templates': dict((name, self.get_template_digest(name))
+                              for name in context.rendered_templates),
+            'config': context.base_config.get_digest(),
+            'modules': self.get_module_digest(),
+            'dependencies': sorted([list(key), digest] for key, digest
+                                   in context.dependencies.items()),
+        }
+
+    def record(self, context, entry=None):
+        if self.entries is None:
+            self.load()
+        if entry is None:
+            entry = self.make_entry(context)
+        self.entries[context.destination_filename] = entry
+
+    def is_stale(self, context):
+        """Checks if the output of the context has to be rebuilt."""
+        entry = self.get_entry(context)
+        if entry is None:
+            return True
+        if entry['modules'] != self.get_module_digest() or \
+           entry['config'] != context.base_config.get_digest():
+            return True
+        for name, digest in entry['templates'].items():
+            if self.get_template_digest(name) != digest:
+                return True
+        for key, digest in entry['dependencies']:
+            if self.builder.get_dependency_digest(*key) != digest:
+                return True
+        filename = context.full_source_filename
+        stat = self.builder.get_source_stat(filename)
+        if stat.st_mtime == entry['source_mtime'] and \
+           stat.st_size == entry['source_size']:
+            return False
+        return hash_file(filename) != entry['source_hash']
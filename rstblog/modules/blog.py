@@ -11,17 +11,21 @@
 from __future__ import with_statement
 
 from __future__ import absolute_import
+import os
+from bisect import bisect_left
 from datetime import datetime, date
+from hashlib import sha1
 from six.moves.urllib.parse import urljoin
 
 from jinja2 import contextfunction
 
 from werkzeug.routing import Rule, Map, NotFound
-from werkzeug.contrib.atom import AtomFeed
 
 from rstblog.signals import after_file_published, \
      before_build_finished
 from rstblog.utils import Pagination
+from rstblog.feeds import get_feed_writer
+from rstblog.cache import read_pickle, write_pickle
 import six
 
 
@@ -55,6 +59,84 @@ class YearArchive(object):
         self.count = sum(len(x.entries) for x in self.months)
 
 
+class EntryIndex(object):
+    """Keeps the blog entries sorted while they are added, so that the
+    newest entries and the per-month listings can be looked up without
+    sorting all entries again.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._entries = []
+        self._sources = set()
+        self._newest_first = None
+        self._by_month = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, source_filename):
+        return source_filename in self._sources
+
+    def add(self, entry):
+        key = (entry.pub_date, entry.day_order)
+        # entries with the same key are inserted in front of the existing
+        # ones so that they keep the order they were added in once the
+        # list is reversed.
+        pos = bisect_left(self._keys, key)
+        self._keys.insert(pos, key)
+        self._entries.insert(pos, entry)
+        self._sources.add(entry.source_filename)
+        self._newest_first = None
+        self._by_month = None
+
+    def get_entries(self):
+        """Returns the entries newest first.  The list is shared and must
+        not be modified.
+        """
+        if self._newest_first is None:
+            self._newest_first = self._entries[::-1]
+        return self._newest_first
+
+    def get_months(self):
+        """Returns a dict of years to dicts of months to the entries of
+        that month, newest first.
+        """
+        if self._by_month is None:
+            self._by_month = {}
+            for entry in self.get_entries():
+                self._by_month \
+                    .setdefault(entry.pub_date.year, {}) \
+                    .setdefault(('0%d' % entry.pub_date.month)[-2:], []) \
+                    .append(entry)
+        return self._by_month
+
+
+def get_entry_index(builder):
+    storage = builder.get_storage('blog_entries')
+    rv = storage.get('index')
+    if rv is None:
+        rv = storage['index'] = EntryIndex()
+    return rv
+
+
+def load_entry_index(builder):
+    """Returns the index of the blog entries of the last build.  It is
+    made from the stored records so no file has to be prepared.  Entries
+    whose source file is gone are left out.  The index is made once and
+    kept until the builder scans the files again.
+    """
+    storage = builder.get_storage('blog_entries')
+    rv = storage.get('previous_index')
+    if rv is None:
+        rv = storage['previous_index'] = EntryIndex()
+        for record in six.itervalues(builder.records.previous()):
+            if record.pub_date is not None and \
+               os.path.isfile(record.full_source_filename):
+                rv.add(record)
+    return rv
+
+
 def test_pattern(path, pattern):
     pattern = '/' + pattern.strip('/') + '/<path:extra>'
     adapter = Map([Rule(pattern)]).bind('dummy.invalid')
@@ -74,106 +156,288 @@ def process_blog_entry(context):
             if rv is not None:
                 context.pub_date = datetime(*rv)
 
-    if context.pub_date is not None:
+    index = get_entry_index(context.builder)
+    if context.pub_date is not None and context.source_filename not in index:
+        # only the compact record is kept so that the context can go away
+        # once it was built.
+        record = context.get_record()
+        record.pub_date = context.pub_date
         context.builder.get_storage('blog') \
             .setdefault(context.pub_date.year, {}) \
             .setdefault(('0%d' % context.pub_date.month)[-2:], []) \
-            .append(context)
+            .append(record)
+        index.add(record)
 
 
 def get_all_entries(builder):
     """Returns all blog entries in reverse order"""
-    result = []
-    storage = builder.get_storage('blog')
-    years = list(storage.items())
-    for year, months in years:
-        for month, contexts in six.iteritems(months):
-            result.extend(contexts)
-    result.sort(key=lambda x: (x.pub_date, x.config.get('day-order', 0)),
-                reverse=True)
-    return result
+    return list(get_entry_index(builder).get_entries())
 
 
 def get_archive_summary(builder):
     """Returns a summary of the stuff in the archives."""
-    storage = builder.get_storage('blog')
-    years = list(storage.items())
+    years = list(get_entry_index(builder).get_months().items())
     years.sort(key=lambda x: -x[0])
-    return [YearArchive(builder, year, months) for year, months in years]
+    return [YearArchive(builder, year, dict((month, list(entries))
+                                            for month, entries
+                                            in six.iteritems(months)))
+            for year, months in years]
 
 
 @contextfunction
 def get_recent_blog_entries(context, limit=10):
-    return get_all_entries(context['builder'])[:limit]
+    # files remember the digest of the entries in the manifest so that
+    # they are built again once the entries change.  The limit of pages
+    # without a file, like the index, is remembered by the page writer.
+    ctx = context.get('ctx')
+    if ctx is not None:
+        ctx.add_dependency('recent_blog_entries', limit)
+    else:
+        storage = context['builder'].get_storage('blog_pages')
+        storage['recent_limit'] = max(storage.get('recent_limit', 0), limit)
+    return get_entry_index(context['builder']).get_entries()[:limit]
+
+
+def get_recent_entries_digest(builder, limit):
+    if builder.files_prepared:
+        index = get_entry_index(builder)
+    else:
+        # the builder only checks if anything has to be built, for example
+        # when the server starts.  The records of the last build stand in
+        # for the files that were not prepared.
+        index = load_entry_index(builder)
+    return sha1(repr([get_entry_signature(x) for x in index
+                      .get_entries()[:limit]]).encode('utf-8')).hexdigest()
+
+
+def get_entry_signature(entry, with_contents=False):
+    """Returns a tuple of everything about an entry that is shown on the
+    index and archive pages.  With `with_contents` the source file is taken
+    into account as well, as needed for the feed.
+    """
+    rv = (entry.slug, entry.title,
+          entry.pub_date and entry.pub_date.isoformat(),
+          entry.summary, entry.day_order)
+    if with_contents:
+        stat = entry.builder.get_source_stat(entry.full_source_filename)
+        rv += (stat.st_mtime, stat.st_size)
+    return rv
+
+
+class PageWriter(object):
+    """Writes pages that are generated from many files, like the index,
+    archive and feed pages of the blog.  For every page a key is remembered
+    that covers the data shown on the page, the templates, the config, the
+    active modules, the recent blog entries and the tags.  Pages with an unchanged
+    key are not rendered again and pages that no longer exist are removed.
+    Every writer needs its own `name` to keep its state under.
+    """
+
+    def __init__(self, builder, name='blog'):
+        self.builder = builder
+        self.state_filename = os.path.join(builder.cache_folder,
+                                           name + '.pickle')
+        state = read_pickle(self.state_filename, {})
+        self.old_pages = state.get('pages', {})
+        self.pages = {}
+        # the limits used by the files are in the manifest, they are
+        # recorded there even if the files were built by worker processes.
+        self.recent_limit = max([state.get('recent_limit', 0)] + [
+            x[0] for x in builder.manifest.get_dependency_args(
+                'recent_blog_entries')])
+        recent = [get_entry_signature(x) for x in get_entry_index(builder)
+                  .get_entries()[:self.recent_limit]]
+        self.base_key = (builder.config.get_digest(),
+                         builder.manifest.get_module_digest(),
+                         repr(recent),
+                         builder.get_dependency_digest('tags'))
+
+    def check(self, templates, dependencies, _key, **values):
+        """Remembers the key of a page and returns `True` if the page has
+        to be written.
+        """
+        filename = self.builder.get_link_filename(_key, **values)
+        manifest = self.builder.manifest
+        key = sha1(repr(self.base_key + (
+            [manifest.get_template_digest(x) for x in templates],
+            dependencies)).encode('utf-8')).hexdigest()
+        self.pages[filename] = key
+        return self.old_pages.get(filename) != key or \
+            not self.builder.output_file_exists(filename)
+
+    def write(self, templates, dependencies, render, _key, **values):
+        if not self.check(templates, dependencies, _key, **values):
+            return
+        with self.builder.open_link_file(_key, **values) as f:
+            f.write(render().encode('utf-8') + b'\n')
+
+    def remove_empty_folders(self, folder):
+        output_folder = self.builder.default_output_folder
+        while folder.startswith(output_folder + os.path.sep):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+
+    def finish(self):
+        for filename in set(self.old_pages) - set(self.pages):
+            if os.path.isfile(filename):
+                os.remove(filename)
+                self.remove_empty_folders(os.path.dirname(filename))
+        recent_limit = max(
+            self.recent_limit,
+            self.builder.get_storage('blog_pages').get('recent_limit', 0))
+        write_pickle(self.state_filename, {
+            'pages':        self.pages,
+            'recent_limit': recent_limit
+        })
 
 
-def write_index_page(builder):
+def write_index_page(builder, writer):
     use_pagination = builder.config.root_get('modules.blog.use_pagination', True)
     per_page = builder.config.root_get('modules.blog.per_page', 10)
-    entries = get_all_entries(builder)
+    entries = get_entry_index(builder).get_entries()
     pagination = Pagination(builder, entries, 1, per_page, 'blog_index')
     while 1:
-        with builder.open_link_file('blog_index', page=pagination.page) as f:
-            rv = builder.render_template('blog/index.html', {
+        def render():
+            return builder.render_template('blog/index.html', {
                 'pagination':       pagination,
                 'show_pagination':  use_pagination
             })
-            f.write(rv.encode('utf-8') + b'\n')
-            if not use_pagination or not pagination.has_next:
-                break
-            pagination = pagination.get_next()
-
-
-def write_archive_pages(builder):
+        dependencies = (pagination.pages, use_pagination,
+                        [get_entry_signature(x)
+                         for x in pagination.get_slice()])
+        writer.write(('blog/index.html', '_pagination.html'),
+                     dependencies, render,
+                     'blog_index', page=pagination.page)
+        if not use_pagination or not pagination.has_next:
+            break
+        pagination = pagination.get_next()
+
+
+def write_archive_pages(builder, writer):
     archive = get_archive_summary(builder)
-    with builder.open_link_file('blog_archive') as f:
-        rv = builder.render_template('blog/archive.html', {
-            'archive':      archive
-        })
-        f.write(rv.encode('utf-8') + b'\n')
+    writer.write(('blog/archive.html',),
+                 [(x.year, [(y.month, y.count) for y in x.months])
+                  for x in archive],
+                 lambda: builder.render_template('blog/archive.html', {
+                     'archive':      archive
+                 }), 'blog_archive')
 
     for entry in archive:
-        with builder.open_link_file('blog_archive', year=entry.year) as f:
-            rv = builder.render_template('blog/year_archive.html', {
-                'entry':    entry
-            })
-            f.write(rv.encode('utf-8') + b'\n')
+        writer.write(('blog/year_archive.html',),
+                     [(x.month, x.count) for x in entry.months],
+                     lambda: builder.render_template('blog/year_archive.html', {
+                         'entry':    entry
+                     }), 'blog_archive', year=entry.year)
         for subentry in entry.months:
-            with builder.open_link_file('blog_archive', year=entry.year,
-                                        month=subentry.month) as f:
-                rv = builder.render_template('blog/month_archive.html', {
-                    'entry':    subentry
-                })
-                f.write(rv.encode('utf-8') + b'\n')
-
+            writer.write(('blog/month_archive.html',),
+                         [get_entry_signature(x) for x in subentry.entries],
+                         lambda: builder.render_template(
+                             'blog/month_archive.html', {
+                                 'entry':    subentry
+                             }),
+                         'blog_archive', year=entry.year,
+                         month=subentry.month)
+
+
+#: the endpoints of the subscription feed, the archived feeds and the
+#: complete feed for every feed format.
+feed_endpoints = {
+    'atom': ('blog_feed', 'blog_feed_archive', 'blog_full_feed'),
+    'json': ('blog_json_feed', 'blog_json_feed_archive',
+             'blog_json_full_feed')
+}
+
+
+def write_feed_file(builder, writer, format, entries, _key, links=None,
+                    complete=False, archive=False, **values):
+    """Writes a feed with the given entries unless it did not change.  The
+    entries are written one by one, with `complete` their contents are not
+    kept for other feeds.
+    """
+    links = links or {}
+    dependencies = (format, sorted(links.items()), complete, archive,
+                    [get_entry_signature(x, with_contents=True)
+                     for x in entries])
+    if not writer.check((), dependencies, _key, **values):
+        return
 
-def write_feed(builder):
     blog_author = builder.config.root_get('author')
     url = builder.config.root_get('canonical_url') or 'http://localhost/'
     name = builder.config.get('feed.name') or u'Recent Blog Posts'
     subtitle = builder.config.get('feed.subtitle') or u'Recent blog posts'
-    feed = AtomFeed(name,
-                    subtitle=subtitle,
-                    feed_url=urljoin(url, builder.link_to('blog_feed')),
-                    url=url)
-    for entry in get_all_entries(builder)[:10]:
-        feed.add(entry.title, six.text_type(entry.render_contents()),
-                 content_type='html', author=blog_author,
-                 url=urljoin(url, entry.slug),
-                 updated=entry.pub_date)
-    with builder.open_link_file('blog_feed') as f:
-        f.write(feed.to_string().encode('utf-8') + b'\n')
+    updated = max(x.pub_date for x in entries) if entries else None
+    with builder.open_link_file(_key, **values) as f:
+        feed = get_feed_writer(format)(
+            f, name, url, urljoin(url, builder.link_to(_key, **values)),
+            subtitle=subtitle, updated=updated,
+            links=dict((rel, urljoin(url, href))
+                       for rel, href in six.iteritems(links)),
+            complete=complete, archive=archive)
+        for entry in entries:
+            feed.add(entry.title, entry.render_contents(not complete),
+                     urljoin(url, entry.slug), entry.pub_date,
+                     author=blog_author)
+        feed.close()
+
+
+def write_feed(builder, writer):
+    """Writes the feeds of the blog in all configured formats.  Next to
+    the feed with the latest entries the older entries can be published
+    as archived feeds (:rfc:`5005`) in pages of the same size, numbered
+    from the oldest one so that their contents do not change.  A complete
+    feed with every entry can be enabled as well.
+    """
+    formats = builder.config.root_get('modules.blog.feed_formats', ['atom'])
+    size = builder.config.root_get('modules.blog.feed_size', 10)
+    use_archive = builder.config.root_get('modules.blog.feed_archive', False)
+    use_full = builder.config.root_get('modules.blog.full_feed', False)
+    entries = get_entry_index(builder).get_entries()
+    oldest_first = entries[::-1]
+    archive_pages = use_archive and size and len(entries) // size or 0
+
+    for format in formats:
+        key, archive_key, full_key = feed_endpoints[format]
+        links = {}
+        if archive_pages:
+            links['prev-archive'] = builder.link_to(archive_key,
+                                                    page=archive_pages)
+        write_feed_file(builder, writer, format, entries[:size], key,
+                        links=links)
+
+        for page in range(1, archive_pages + 1):
+            links = {'current': builder.link_to(key)}
+            if page > 1:
+                links['prev-archive'] = builder.link_to(archive_key,
+                                                        page=page - 1)
+            if page < archive_pages:
+                links['next-archive'] = builder.link_to(archive_key,
+                                                        page=page + 1)
+            write_feed_file(builder, writer, format,
+                            oldest_first[(page - 1) * size:page * size][::-1],
+                            archive_key, links=links, archive=True,
+                            page=page)
+
+        if use_full:
+            write_feed_file(builder, writer, format, entries, full_key,
+                            complete=True)
 
 
 def write_blog_files(builder):
-    write_index_page(builder)
-    write_archive_pages(builder)
-    write_feed(builder)
+    writer = PageWriter(builder)
+    write_index_page(builder, writer)
+    write_archive_pages(builder, writer)
+    write_feed(builder, writer)
+    writer.finish()
 
 
 def setup(builder):
     after_file_published.connect(process_blog_entry)
     before_build_finished.connect(write_blog_files)
+    builder.register_dependency('recent_blog_entries',
+                                get_recent_entries_digest)
     builder.register_url('blog_index', config_key='modules.blog.index_url',
                          config_default='/', defaults={'page': 1})
     builder.register_url('blog_index', config_key='modules.blog.paged_index_url',
@@ -188,6 +452,21 @@ def setup(builder):
                          config_default='/<year>/<month>/')
     builder.register_url('blog_feed', config_key='modules.blog.feed_url',
                          config_default='/feed.atom')
+    builder.register_url('blog_feed_archive',
+                         config_key='modules.blog.feed_archive_url',
+                         config_default='/feed/archive/<int:page>.atom')
+    builder.register_url('blog_full_feed',
+                         config_key='modules.blog.full_feed_url',
+                         config_default='/feed/full.atom')
+    builder.register_url('blog_json_feed',
+                         config_key='modules.blog.json_feed_url',
+                         config_default='/feed.json')
+    builder.register_url('blog_json_feed_archive',
+                         config_key='modules.blog.json_feed_archive_url',
+                         config_default='/feed/archive/<int:page>.json')
+    builder.register_url('blog_json_full_feed',
+                         config_key='modules.blog.json_full_feed_url',
+                         config_default='/feed/full.json')
     builder.jinja_env.globals.update(
         get_recent_blog_entries=get_recent_blog_entries
     )
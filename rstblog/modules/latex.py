@@ -3,7 +3,10 @@
     rstblog.modules.latex
     ~~~~~~~~~~~~~~~~~~~~~
 
-    Simple latex support for formulas.
+    Simple latex support for formulas.  Rendered formulas are kept in a
+    cache so that unchanged formulas do not go through latex again, and
+    all formulas of a document that are not cached yet are rendered with
+    a single latex run.
 
     :copyright: (c) 2010 by Armin Ronacher, Georg Brandl.
     :license: BSD, see LICENSE for more details.
@@ -13,15 +16,18 @@ import os
 import re
 import tempfile
 import shutil
-from hashlib import sha1
-from os import path, getcwd, chdir
+from os import path
 from subprocess import Popen, PIPE
 from werkzeug import escape
 
 from docutils import nodes, utils
 from docutils.parsers.rst import Directive, directives, roles
+from docutils.transforms import Transform
 
-DOC_WRAPPER = r'''
+from rstblog.signals import before_build_finished
+from rstblog.cache import FragmentCache, DEFAULT_FRAGMENT_CACHE_SIZE
+
+DOC_HEAD = r'''
 \documentclass[12pt]{article}
 \usepackage[utf8x]{inputenc}
 \usepackage{amsmath}
@@ -31,15 +37,61 @@ DOC_WRAPPER = r'''
 %%\usepackage{mathpazo}
 \usepackage{bm}
 \usepackage[active]{preview}
+%s
 \pagestyle{empty}
 \begin{document}
+'''
+
+DOC_FORMULA = r'''
 \begin{preview}
 %s
 \end{preview}
+'''
+
+DOC_TAIL = r'''
 \end{document}
 '''
 
-_depth_re = re.compile(rb'\[\d+ depth=(-?\d+)\]')
+_depth_re = re.compile(rb'\[(\d+) depth=(-?\d+)\]')
+
+#: the cache of rendered formulas, created in :func:`setup`.
+math_cache = None
+
+
+class math_image(nodes.Inline, nodes.Element):
+    """Placeholder for a formula.  It is replaced with the image once all
+    formulas of the document are rendered.
+    """
+
+
+class RenderMath(Transform):
+    """Renders all formulas of a document at once."""
+    default_priority = 800
+
+    def apply(self):
+        # substitutions copy the placeholders of their definitions, so the
+        # document is searched instead of remembering the created nodes.
+        find = getattr(self.document, 'findall', self.document.traverse)
+        placeholders = list(find(math_image))
+        context = self.document.settings.rstblog_context
+        results = render_math_batch(context,
+                                    [x['latex'] for x in placeholders])
+        for node in placeholders:
+            url, depth = results[node['latex']]
+            if node['display']:
+                html = u'<blockquote class="math">%s</blockquote>' \
+                    % make_imgtag(url, None, node['latex'])
+            else:
+                html = u'<span class="math">%s</span>' \
+                    % make_imgtag(url, depth, node['latex'])
+            node.replace_self(nodes.raw('', html, format='html'))
+
+
+def make_placeholder(document, latex, display):
+    if not getattr(document, 'rstblog_math', False):
+        document.rstblog_math = True
+        document.transformer.add_transform(RenderMath)
+    return math_image(latex=latex, display=display)
 
 
 def wrap_displaymath(math):
@@ -49,26 +101,28 @@ def wrap_displaymath(math):
     return '\\begin{gather}\n' + '\\\\'.join(ret) + '\n\\end{gather}'
 
 
-def find_depth(stdout):
-    for line in stdout.splitlines():
-        m = _depth_re.match(line)
-        if m:
-            return int(m.group(1))
+def find_depths(stdout):
+    """Returns a dict of page numbers to depths from the dvipng output."""
+    return dict((int(m.group(1)), int(m.group(2)))
+                for m in _depth_re.finditer(stdout))
 
 
-def render_math(context, math):
-    relname = '_math/%s.png' % sha1(math.encode('utf-8')).hexdigest()
-    full_filename = context.builder.get_full_static_filename(relname)
-    url = context.builder.get_static_url(relname)
+def get_latex_settings(builder):
+    font_size = builder.config.root_get('modules.latex.font_size', 16)
+    preamble = builder.config.root_get('modules.latex.preamble', '')
+    return font_size, preamble
 
-    # if we rebuild the document, we also want to rebuild the math
-    # for it.
-    if os.path.isfile(full_filename):
-        os.remove(full_filename)
 
-    latex = DOC_WRAPPER % wrap_displaymath(math)
+def run_latex(formulas, font_size, preamble):
+    """Renders the given formulas with one latex and one dvipng run and
+    returns a list of ``(png_data, depth)`` tuples.  If latex fails the
+    formulas are rendered one by one so that the error is reported for
+    the formula that caused it.
+    """
+    latex = DOC_HEAD % preamble + \
+        ''.join(DOC_FORMULA % wrap_displaymath(x) for x in formulas) + \
+        DOC_TAIL
 
-    depth = None
     tempdir = tempfile.mkdtemp()
     try:
         tf = open(path.join(tempdir, 'math.tex'), 'wb')
@@ -76,29 +130,23 @@ def render_math(context, math):
         tf.close()
 
         # build latex command; old versions of latex don't have the
-        # --output-directory option, so we have to manually chdir to the
-        # temp dir to run it.
+        # --output-directory option, so it runs in the temp dir instead.
+        # That is done through the working directory of the subprocess
+        # and not with chdir so that other threads are not affected.
         ltx_args = ['latex', '--interaction=nonstopmode', 'math.tex']
-
-        curdir = getcwd()
-        chdir(tempdir)
-
-        try:
-            p = Popen(ltx_args, stdout=PIPE, stderr=PIPE)
-            stdout, stderr = p.communicate()
-        finally:
-            chdir(curdir)
+        p = Popen(ltx_args, stdout=PIPE, stderr=PIPE, cwd=tempdir)
+        stdout, stderr = p.communicate()
 
         if p.returncode != 0:
+            if len(formulas) > 1:
+                return [run_latex([x], font_size, preamble)[0]
+                        for x in formulas]
             raise Exception('latex exited with error:\n[stderr]\n%s\n'
                             '[stdout]\n%s' % (stderr, stdout))
 
-        directory = os.path.dirname(full_filename)
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
-        dvipng_args = ['dvipng', '-o', full_filename, '-T', 'tight', '-z9',
-                       '-D', str(int(context.builder.config.root_get(
-                            'modules.latex.font_size', 16) * 72.27 / 10)),
+        dvipng_args = ['dvipng', '-o', path.join(tempdir, 'math%d.png'),
+                       '-T', 'tight', '-z9',
+                       '-D', str(int(font_size * 72.27 / 10)),
                        '-bg', 'Transparent',
                        '--depth', os.path.join(tempdir, 'math.dvi')]
         p = Popen(dvipng_args, stdout=PIPE, stderr=PIPE)
@@ -106,7 +154,13 @@ def render_math(context, math):
         if p.returncode != 0:
             raise Exception('dvipng exited with error:\n[stderr]\n%s\n'
                             '[stdout]\n%s' % (stderr, stdout))
-        depth = find_depth(stdout)
+        depths = find_depths(stdout)
+
+        rv = []
+        for page in range(1, len(formulas) + 1):
+            with open(path.join(tempdir, 'math%d.png' % page), 'rb') as f:
+                rv.append((f.read(), depths.get(page)))
+        return rv
     finally:
         try:
             shutil.rmtree(tempdir)
@@ -114,7 +168,45 @@ def render_math(context, math):
             # might happen? unsure
             pass
 
-    return url, depth
+
+def write_math_image(context, key, data, depth):
+    relname = '_math/%s.png' % key
+    with context.builder.open_static_file(relname, 'wb') as f:
+        f.write(data)
+    context.add_generated_file(
+        context.builder.get_full_static_filename(relname))
+    return context.builder.get_static_url(relname), depth
+
+
+def render_math_batch(context, formulas):
+    """Renders a list of formulas and returns a dict that maps each of
+    them to the URL of its image and its depth.  Formulas are looked up
+    in the math cache first, the rest is rendered with a single latex run.
+    """
+    font_size, preamble = get_latex_settings(context.builder)
+    rv = {}
+    missing = {}
+    for math in formulas:
+        if math in rv or math in missing:
+            continue
+        key = math_cache.make_key(math, font_size, preamble)
+        cached = math_cache.get(key)
+        if cached is None:
+            missing[math] = key
+        else:
+            rv[math] = write_math_image(context, key, *cached)
+
+    if missing:
+        todo = list(missing)
+        results = run_latex(todo, font_size, preamble)
+        for math, (data, depth) in zip(todo, results):
+            math_cache.set(missing[math], (data, depth))
+            rv[math] = write_math_image(context, missing[math], data, depth)
+    return rv
+
+
+def render_math(context, math):
+    return render_math_batch(context, [math])[math]
 
 
 def make_imgtag(url, depth, latex):
@@ -139,19 +231,24 @@ class MathDirective(Directive):
         latex = '\n'.join(self.content)
         if self.arguments and self.arguments[0]:
             latex = self.arguments[0] + '\n\n' + latex
-        url, _ = render_math(self.state.document.settings.rstblog_context,
-                             latex)
-        return [nodes.raw('', u'<blockquote class="math">%s</blockquote>'
-                          % make_imgtag(url, None, latex), format='html')]
+        return [make_placeholder(self.state.document, latex, True)]
 
 
 def math_role(role, rawtext, text, lineno, inliner, options={}, content=[]):
     latex = utils.unescape(text, restore_backslashes=True)
-    url, depth = render_math(inliner.document.settings.rstblog_context, latex)
-    return [nodes.raw('', u'<span class="math">%s</span>' %
-                      make_imgtag(url, depth, latex), format='html')], []
+    return [make_placeholder(inliner.document, latex, False)], []
+
+
+def prune_cache(builder):
+    math_cache.prune()
 
 
 def setup(builder):
+    global math_cache
+    cache_size = builder.config.root_get('modules.latex.cache_size',
+                                         DEFAULT_FRAGMENT_CACHE_SIZE)
+    math_cache = FragmentCache(os.path.join(builder.cache_folder, 'math'),
+                               int(cache_size * 1024 * 1024))
     directives.register_directive('math', MathDirective)
     roles.register_local_role('math', math_role)
+    before_build_finished.connect(prune_cache)
@@ -9,13 +9,16 @@
     :license: BSD, see LICENSE for more details.
 """
 from __future__ import absolute_import
+import os
+
 from rstblog.signals import before_file_processed, \
      before_build_finished
+from rstblog.cache import FragmentCache, DEFAULT_FRAGMENT_CACHE_SIZE
 
 from docutils import nodes
 from docutils.parsers.rst import Directive, directives
 
-from pygments import highlight
+from pygments import highlight, __version__ as pygments_version
 from pygments.lexers import get_lexer_by_name, TextLexer
 from pygments.lexers.php import PhpLexer
 from pygments.formatters import HtmlFormatter
@@ -23,6 +26,36 @@ from pygments.styles import get_style_by_name
 
 
 html_formatter = None
+highlight_cache = None
+_formatter_key = None
+_lexers = {}
+
+
+def get_lexer(name):
+    """Returns a lexer for the given name.  Looking lexers up goes
+    through the plugin entry points which is slow, so the instances are
+    kept around.
+    """
+    rv = _lexers.get(name)
+    if rv is None:
+        try:
+            if name == "phpinline":
+                rv = PhpLexer(startinline=True)
+            else:
+                rv = get_lexer_by_name(name)
+        except ValueError:
+            rv = TextLexer()
+        _lexers[name] = rv
+    return rv
+
+
+def highlight_code(code, name):
+    key = highlight_cache.make_key(code, name, _formatter_key)
+    rv = highlight_cache.get(key)
+    if rv is None:
+        rv = highlight(code, get_lexer(name), html_formatter)
+        highlight_cache.set(key, rv)
+    return rv
 
 
 class CodeBlock(Directive):
@@ -32,16 +65,8 @@ class CodeBlock(Directive):
     final_argument_whitespace = False
 
     def run(self):
-        try:
-            name = self.arguments[0]
-            if name == "phpinline":
-                lexer = PhpLexer(startinline=True)
-            else:
-                lexer = get_lexer_by_name(name)
-        except ValueError:
-            lexer = TextLexer()
         code = u'\n'.join(self.content)
-        formatted = highlight(code, lexer, html_formatter)
+        formatted = highlight_code(code, self.arguments[0])
         return [nodes.raw('', formatted, format='html')]
 
 
@@ -54,11 +79,24 @@ def write_stylesheet(builder, **kwargs):
         f.write(html_formatter.get_style_defs())
 
 
+def prune_cache(builder, **kwargs):
+    highlight_cache.prune()
+
+
 def setup(builder):
-    global html_formatter
-    style = get_style_by_name(builder.config.root_get('modules.pygments.style'))
+    global html_formatter, highlight_cache, _formatter_key
+    style_name = builder.config.root_get('modules.pygments.style')
+    style = get_style_by_name(style_name)
     html_formatter = HtmlFormatter(style=style)
+    _formatter_key = repr((pygments_version, style_name, sorted(
+        (k, v) for k, v in html_formatter.options.items() if k != 'style')))
+    cache_size = builder.config.root_get('modules.pygments.cache_size',
+                                         DEFAULT_FRAGMENT_CACHE_SIZE)
+    highlight_cache = FragmentCache(
+        os.path.join(builder.cache_folder, 'pygments'),
+        int(cache_size * 1024 * 1024))
     directives.register_directive('code-block', CodeBlock)
     directives.register_directive('sourcecode', CodeBlock)
     before_file_processed.connect(inject_stylesheet)
     before_build_finished.connect(write_stylesheet)
+    before_build_finished.connect(prune_cache)
@@ -9,15 +9,18 @@
     :license: BSD, see LICENSE for more details.
 """
 from __future__ import absolute_import
+import os
 from math import log
+from hashlib import sha1
+from functools import partial
 from six.moves.urllib.parse import urljoin
 
 from jinja2 import contextfunction
 
-from werkzeug.contrib.atom import AtomFeed
-
 from rstblog.signals import after_file_published, \
      before_build_finished
+from rstblog.modules.blog import PageWriter, get_entry_signature
+from rstblog.feeds import AtomFeedWriter
 import six
 
 
@@ -31,6 +34,9 @@ class Tag(object):
 
 @contextfunction
 def get_tags(context, limit=50):
+    ctx = context.get('ctx')
+    if ctx is not None:
+        ctx.add_dependency('tags')
     tags = get_tag_summary(context['builder'])
     if limit:
         tags.sort(key=lambda x: -x.count)
@@ -49,6 +55,30 @@ def get_tag_summary(builder):
     return result
 
 
+def load_tag_counts(builder):
+    """Returns a dict of tags to the number of entries of the last build.
+    It is made from the stored records like the blog entry index, see
+    :func:`~rstblog.modules.blog.load_entry_index`.
+    """
+    storage = builder.get_storage('tags')
+    rv = storage.get('previous_counts')
+    if rv is None:
+        rv = storage['previous_counts'] = {}
+        for record in six.itervalues(builder.records.previous()):
+            if os.path.isfile(record.full_source_filename):
+                for tag in record.tags:
+                    rv[tag] = rv.get(tag, 0) + 1
+    return rv
+
+
+def get_tags_digest(builder):
+    if builder.files_prepared:
+        counts = dict((x.name, x.count) for x in get_tag_summary(builder))
+    else:
+        counts = load_tag_counts(builder)
+    return sha1(repr(sorted(counts.items())).encode('utf-8')).hexdigest()
+
+
 def get_tagged_entries(builder, tag):
     if isinstance(tag, Tag):
         tag = tag.name
@@ -58,43 +88,50 @@ def get_tagged_entries(builder, tag):
 
 
 def remember_tags(context):
-    tags = context.config.merged_get('tags') or []
     storage = context.builder.get_storage('tags')
     by_file = storage.setdefault('by_file', {})
+    if context.source_filename in by_file:
+        context.tags = frozenset(by_file[context.source_filename])
+        return
+    tags = context.config.merged_get('tags') or []
     by_file[context.source_filename] = tags
+    context.tags = frozenset(tags)
+    if not tags:
+        return
+    record = context.get_record()
+    record.tags = context.tags
     by_tag = storage.setdefault('by_tag', {})
     for tag in tags:
-        by_tag.setdefault(tag, []).append(context)
-    context.tags = frozenset(tags)
+        by_tag.setdefault(tag, []).append(record)
 
 
-def write_tagcloud_page(builder):
-    with builder.open_link_file('tagcloud') as f:
-        rv = builder.render_template('tagcloud.html')
-        f.write(rv.encode('utf-8') + b'\n')
+def write_tagcloud_page(builder, writer):
+    writer.write(('tagcloud.html',),
+                 [(x.name, x.count) for x in get_tag_summary(builder)],
+                 lambda: builder.render_template('tagcloud.html'),
+                 'tagcloud')
 
 
-def write_tag_feed(builder, tag):
+def write_tag_feed(builder, tag, entries):
     blog_author = builder.config.root_get('author')
     url = builder.config.root_get('canonical_url') or 'http://localhost/'
     name = builder.config.get('feed.name') or u'Recent Blog Posts'
     subtitle = builder.config.get('feed.subtitle') or u'Recent blog posts'
-    feed = AtomFeed(name,
-                    subtitle=subtitle,
-                    feed_url=urljoin(url, builder.link_to('blog_feed')),
-                    url=url)
-    for entry in get_tagged_entries(builder, tag)[:10]:
-        feed.add(entry.title, six.text_type(entry.render_contents()),
-                 content_type='html', author=blog_author,
-                 url=urljoin(url, entry.slug),
-                 updated=entry.pub_date)
+    dates = [x.pub_date for x in entries if x.pub_date is not None]
     with builder.open_link_file('tagfeed', tag=tag.name) as f:
-        f.write(feed.to_string().encode('utf-8') + b'\n')
-
-
-def write_tag_page(builder, tag):
-    entries = get_tagged_entries(builder, tag)
-    entries.sort(key=lambda x: (x.title or '').lower())
+        feed = AtomFeedWriter(f, name, url,
+                              urljoin(url, builder.link_to('tagfeed',
+                                                           tag=tag.name)),
+                              subtitle=subtitle,
+                              updated=dates and max(dates) or None)
+        for entry in entries:
+            feed.add(entry.title, entry.render_contents(),
+                     urljoin(url, entry.slug), entry.pub_date,
+                     author=blog_author)
+        feed.close()
+
+
+def write_tag_page(builder, tag, entries):
     with builder.open_link_file('tag', tag=tag.name) as f:
         rv = builder.render_template('tag.html', {
             'tag':      tag,
@@ -103,16 +140,54 @@ def write_tag_page(builder, tag):
         f.write(rv.encode('utf-8') + b'\n')
 
 
+def write_tag_outputs(builder, tag, page_entries, feed_entries):
+    """Writes the page and the feed of a tag, either of them can be
+    `None` if it is unchanged.
+    """
+    if page_entries is not None:
+        write_tag_page(builder, tag, page_entries)
+    if feed_entries is not None:
+        write_tag_feed(builder, tag, feed_entries)
+
+
 def write_tag_files(builder):
-    write_tagcloud_page(builder)
+    """Writes the tag cloud and the page and feed of every tag.  Only the
+    pages and feeds of tags whose entries changed are written again, on
+    the worker pool of the builder if the build runs with several jobs.
+    The page and the feed of a tag are written by the same job.
+    """
+    writer = PageWriter(builder, 'tags')
+    write_tagcloud_page(builder, writer)
+    jobs = []
     for tag in get_tag_summary(builder):
-        write_tag_page(builder, tag)
-        write_tag_feed(builder, tag)
+        entries = sorted(get_tagged_entries(builder, tag),
+                         key=lambda x: (x.title or '').lower())
+        page_entries = feed_entries = None
+        if writer.check(('tag.html',),
+                        [get_entry_signature(x) for x in entries],
+                        'tag', tag=tag.name):
+            page_entries = entries
+        entries = entries[:10]
+        if writer.check((),
+                        [get_entry_signature(x, with_contents=True)
+                         for x in entries],
+                        'tagfeed', tag=tag.name):
+            # the contents are rendered here so that the workers inherit
+            # them and no entry is rendered more than once.
+            for entry in entries:
+                entry.render_contents()
+            feed_entries = entries
+        if page_entries is not None or feed_entries is not None:
+            jobs.append(partial(write_tag_outputs, builder, tag,
+                                page_entries, feed_entries))
+    builder.run_jobs(jobs)
+    writer.finish()
 
 
 def setup(builder):
     after_file_published.connect(remember_tags)
     before_build_finished.connect(write_tag_files)
+    builder.register_dependency('tags', get_tags_digest)
     builder.register_url('tag', config_key='modules.tags.tag_url',
                          config_default='/tags/<tag>/')
     builder.register_url('tagfeed', config_key='modules.tags.tag_feed_url',
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    rstblog.profiler
+    ~~~~~~~~~~~~~~~~
+
+    Records how long the phases of a build take, for every source file and
+    every template, and writes reports about it.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+from __future__ import absolute_import
+import os
+import json
+
+import six
+
+from rstblog.signals import get_receiver_name, timer
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+class Span(object):
+    """A timed section of a build.  Spans nest, the time of the inner spans
+    is subtracted from the self time of the outer one and spans without a
+    file belong to the file of the span they are nested in.
+    """
+    __slots__ = ('profiler', 'phase', 'name', 'file', 'start', 'children')
+
+    def __init__(self, profiler, phase, name, file):
+        self.profiler = profiler
+        self.phase = phase
+        self.name = name
+        self.file = file
+        self.start = None
+        self.children = 0.0
+
+    def __enter__(self):
+        stack = self.profiler._stack
+        if self.file is None and stack:
+            self.file = stack[-1].file
+        stack.append(self)
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = timer() - self.start
+        stack = self.profiler._stack
+        stack.pop()
+        if stack:
+            stack[-1].children += duration
+        self.profiler.events.append((self.phase, self.name, self.file,
+                                     self.start - self.profiler.started,
+                                     duration, duration - self.children))
+
+
+class Profiler(object):
+    """Collects the spans of a build.  A disabled profiler hands out spans
+    that do nothing, so the builder can use one all the time.
+
+    Every event is a tuple of ``(phase, name, file, start, duration,
+    self_time)`` with the times in seconds.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        self._stack = []
+        self.started = timer()
+
+    def span(self, phase, name=None, file=None):
+        if not self.enabled:
+            return _null_span
+        return Span(self, phase, name, file)
+
+    def send(self, signal, sender, phase, **kwargs):
+        """Sends a signal and records every receiver as a span of its
+        own, named after the receiver.
+        """
+        if not self.enabled:
+            return signal.send(sender, **kwargs)
+        call = getattr(signal, 'call_receiver', None)
+        rv = []
+        for receiver in signal.receivers_for(sender):
+            with self.span(phase, get_receiver_name(receiver)):
+                if call is not None:
+                    result = call(receiver, sender, **kwargs)
+                else:
+                    result = receiver(sender, **kwargs)
+            rv.append((receiver, result))
+        return rv
+
+    def get_summary(self):
+        """Returns the totals of the events by phase, source file,
+        template and build finishing handler.
+        """
+        phases = {}
+        files = {}
+        templates = {}
+        handlers = {}
+
+        def add(mapping, key, duration):
+            item = mapping.setdefault(key, {'count': 0, 'total': 0.0})
+            item['count'] += 1
+            item['total'] += duration
+
+        for phase, name, file, start, duration, self_time in self.events:
+            item = phases.setdefault(phase, {'count': 0, 'total': 0.0,
+                                             'self': 0.0})
+            item['count'] += 1
+            item['total'] += duration
+            item['self'] += self_time
+            if file is not None:
+                files[file] = files.get(file, 0.0) + self_time
+            if phase == 'render':
+                add(templates, name, duration)
+            elif phase == 'finish':
+                add(handlers, name, duration)
+        return {
+            'phases':       phases,
+            'files':        files,
+            'templates':    templates,
+            'handlers':     handlers
+        }
+
+    def format_report(self, limit=20):
+        """Formats the summary as text, slowest first."""
+        summary = self.get_summary()
+        lines = []
+
+        def section(title, rows):
+            lines.append(title)
+            for name, total, extra in rows[:limit]:
+                lines.append(('  %10.3fs  %-50s %s'
+                              % (total, name, extra)).rstrip())
+            if len(rows) > limit:
+                lines.append('  ... %d more' % (len(rows) - limit))
+            lines.append('')
+
+        section('Phases (self time):', sorted(
+            [(phase, item['self'], '%d calls, %.3fs total'
+              % (item['count'], item['total']))
+             for phase, item in six.iteritems(summary['phases'])],
+            key=lambda x: -x[1]))
+        section('Source files:', sorted(
+            [(file, total, '') for file, total
+             in six.iteritems(summary['files'])], key=lambda x: -x[1]))
+        for key, title in ('templates', 'Templates:'), \
+                          ('handlers', 'Build finishing handlers:'):
+            section(title, sorted(
+                [(name, item['total'], '%d calls' % item['count'])
+                 for name, item in six.iteritems(summary[key])],
+                key=lambda x: -x[1]))
+        return '\n'.join(lines)
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({
+                'summary':  self.get_summary(),
+                'events':   [dict(zip(('phase', 'name', 'file', 'start',
+                                       'duration', 'self'), x))
+                             for x in self.events]
+            }, f, indent=2, sort_keys=True)
+
+    def write_trace(self, filename):
+        """Writes the events in the trace event format that Chrome's
+        ``about:tracing`` and similar viewers load.
+        """
+        events = []
+        for phase, name, file, start, duration, self_time in self.events:
+            events.append({
+                'name':     name or file or phase,
+                'cat':      phase,
+                'ph':       'X',
+                'ts':       start * 1e6,
+                'dur':      duration * 1e6,
+                'pid':      os.getpid(),
+                'tid':      1,
+                'args':     {'file': file}
+            })
+        events.sort(key=lambda x: x['ts'])
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+    def write_reports(self, folder):
+        """Writes the JSON and the trace file into the given folder and
+        returns their filenames.
+        """
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        json_filename = os.path.join(folder, 'profile.json')
+        trace_filename = os.path.join(folder, 'trace.json')
+        self.write_json(json_filename)
+        self.write_trace(trace_filename)
+        return json_filename, trace_filename
@@ -11,13 +11,34 @@
 from __future__ import with_statement
 from __future__ import absolute_import
 import os
+import re
 import yaml
-import shutil
 from datetime import datetime
 from io import StringIO
 from weakref import ref
 
 
+_adornment_re = re.compile(r'^([!-/:-@\[-`{-~])\1*$')
+_plain_title_re = re.compile(r'^[^\W\d_][^*`|_\[\]\\:]*$', re.UNICODE)
+
+
+def get_plain_title(lines):
+    """Returns the text of a title block that is a section title without
+    any inline markup, which docutils would render as it is.  For other
+    title blocks `None` is returned.
+    """
+    if len(lines) == 3 and lines[0] == lines[2]:
+        lines = [lines[1].strip(), lines[2]]
+    if len(lines) != 2:
+        return None
+    text, underline = lines
+    if _plain_title_re.match(text) is None or \
+       _adornment_re.match(underline) is None or \
+       len(underline) < len(text):
+        return None
+    return u' '.join(text.split())
+
+
 class Program(object):
 
     def __init__(self, context):
@@ -53,9 +74,10 @@ class CopyProgram(Program):
     """A program that copies a file over unchanged"""
 
     def run(self):
-        self.context.make_destination_folder()
-        shutil.copy(self.context.full_source_filename,
-                    self.context.full_destination_filename)
+        with self.context.builder.profiler.span('write'):
+            self.context.builder.copy_output_file(
+                self.context.full_source_filename,
+                self.context.full_destination_filename)
 
     def get_desired_filename(self):
         return self.context.source_filename
@@ -72,8 +94,9 @@ class TemplatedProgram(Program):
             or self.default_template
         context = self.get_template_context()
         rv = self.context.render_template(template_name, context)
-        with self.context.open_destination_file() as f:
-            f.write(rv.encode('utf-8') + b'\n')
+        with self.context.builder.profiler.span('write'):
+            with self.context.open_destination_file() as f:
+                f.write(rv.encode('utf-8') + b'\n')
 
 
 class RSTProgram(TemplatedProgram):
@@ -82,52 +105,81 @@ class RSTProgram(TemplatedProgram):
     _fragment_cache = None
 
     def prepare(self):
-        headers = ['---']
-        with self.context.open_source_file() as f:
-            for line in f:
-                line = line.rstrip().decode("utf-8")
-                if not line:
-                    break
-                headers.append(line)
-            title = self.parse_text_title(f)
+        cache = self.context.builder.metadata_cache
+        stat = self.context.builder.get_source_stat(
+            self.context.full_source_filename)
+        metadata = cache.get(self.context.source_filename, stat)
+        # entries of other versions have a different length
+        if metadata is None or len(metadata) != 2:
+            cfg = self.read_header()
+            metadata = cfg, self.parse_text_title()
+            cache.set(self.context.source_filename, stat, metadata)
+        cfg, title = metadata
+        self.apply_header(cfg)
 
-        cfg = yaml.safe_load(StringIO('\n'.join(headers)))
         if cfg:
-            if not isinstance(cfg, dict):
-                raise ValueError('expected dict config in file "%s", got: %.40r' \
-                    % (self.context.source_filename, cfg))
-            self.context.config = self.context.config.add_from_dict(cfg)
-            self.context.destination_filename = cfg.get(
-                'destination_filename',
-                self.context.destination_filename)
-
             title_override = cfg.get('title')
             if title_override is not None:
                 title = title_override
 
-            pub_date_override = cfg.get('pub_date')
-            if pub_date_override is not None:
-                if not isinstance(pub_date_override, datetime):
-                    pub_date_override = datetime(pub_date_override.year,
-                                                 pub_date_override.month,
-                                                 pub_date_override.day)
-                self.context.pub_date = pub_date_override
-
-            summary_override = cfg.get('summary')
-            if summary_override is not None:
-                self.context.summary = summary_override
-
         if title is not None:
             self.context.title = title
 
-    def parse_text_title(self, f):
+    def read_header(self):
+        headers = ['---']
+        with self.context.open_source_file() as f:
+            for line in f:
+                line = line.rstrip().decode("utf-8")
+                if not line:
+                    break
+                headers.append(line)
+
+        cfg = yaml.safe_load(StringIO('\n'.join(headers)))
+        if cfg and not isinstance(cfg, dict):
+            raise ValueError('expected dict config in file "%s", got: %.40r' \
+                % (self.context.source_filename, cfg))
+        return cfg
+
+    def apply_header(self, cfg):
+        if not cfg:
+            return
+        self.context.config = self.context.config.add_from_dict(cfg)
+        self.context.destination_filename = cfg.get(
+            'destination_filename',
+            self.context.destination_filename)
+
+        pub_date_override = cfg.get('pub_date')
+        if pub_date_override is not None:
+            if not isinstance(pub_date_override, datetime):
+                pub_date_override = datetime(pub_date_override.year,
+                                             pub_date_override.month,
+                                             pub_date_override.day)
+            self.context.pub_date = pub_date_override
+
+        summary_override = cfg.get('summary')
+        if summary_override is not None:
+            self.context.summary = summary_override
+
+    def parse_text_title(self):
+        # the body is rendered when the file is built, which can happen in
+        # a worker process.  Only titles with markup have to be rendered
+        # here, on their own.
         buffer = []
-        for line in f:
-            line = line.rstrip()
-            if not line:
-                break
-            buffer.append(line)
-        return self.context.render_rst(b'\n'.join(buffer).decode('utf-8')).get('title')
+        with self.context.open_source_file() as f:
+            while f.readline().strip():
+                pass
+            for line in f:
+                line = line.rstrip().decode('utf-8')
+                if not line:
+                    break
+                buffer.append(line)
+        title = None
+        # docutils would replace quotes, dashes and ellipses
+        if not self.context.builder.get_rst_settings().smart_quotes:
+            title = get_plain_title(buffer)
+        if title is None:
+            title = self.context.render_rst(u'\n'.join(buffer)).get('title')
+        return title
 
     def get_fragments(self):
         if self._fragment_cache is not None:
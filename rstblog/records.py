@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+    rstblog.records
+    ~~~~~~~~~~~~~~~
+
+    Compact records of published files.  Modules that aggregate files,
+    like the blog and the tags, keep these instead of the contexts.  The
+    records of a build are stored in the cache folder so that the next
+    build can tell what changed without preparing the files again.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+import os
+import weakref
+
+from rstblog.cache import read_pickle, write_pickle
+
+
+#: bump this if the fields of the records change.  Stored records with a
+#: different version are ignored.
+RECORDS_VERSION = 1
+
+
+class EntryRecord(object):
+    """A record of a published file with what the index, archive, tag and
+    feed pages show about it.  The contents are not kept, if they are
+    needed after the context was released the file is prepared again.
+
+    Records can be pickled.  Only the data is stored, records that were
+    loaded have to be bound to a builder with :meth:`bind` before their
+    contents can be rendered.
+    """
+    __slots__ = ('builder', 'source_filename', 'slug', 'title', 'pub_date',
+                 'summary', 'summary_html', 'day_order', 'tags', '_context')
+
+    #: the slots that make up the stored state of a record.
+    fields = ('source_filename', 'slug', 'title', 'pub_date', 'summary',
+              'summary_html', 'day_order', 'tags')
+
+    def __init__(self, builder, source_filename, slug, title=None,
+                 pub_date=None, summary=None, summary_html=None,
+                 day_order=0, tags=frozenset()):
+        self.builder = builder
+        self.source_filename = source_filename
+        self.slug = slug
+        self.title = title
+        self.pub_date = pub_date
+        self.summary = summary
+        self.summary_html = summary_html
+        self.day_order = day_order
+        self.tags = tags
+        self._context = None
+
+    @classmethod
+    def from_context(cls, context):
+        rv = cls(context.builder, context.source_filename, context.slug,
+                 title=context.title,
+                 pub_date=context.pub_date,
+                 summary=context.summary,
+                 summary_html=context.render_summary(),
+                 day_order=context.config.get('day-order', 0),
+                 tags=getattr(context, 'tags', frozenset()))
+        rv._context = weakref.ref(context)
+        return rv
+
+    def __getstate__(self):
+        return tuple(getattr(self, x) for x in self.fields)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.fields, state):
+            setattr(self, name, value)
+        self.builder = None
+        self._context = None
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.source_filename)
+
+    def bind(self, builder):
+        """Attaches a loaded record to a builder."""
+        self.builder = builder
+        return self
+
+    @property
+    def full_source_filename(self):
+        return os.path.join(self.builder.project_folder, self.source_filename)
+
+    def restore(self, context):
+        """Copies what the modules set on the context of the record when
+        it was published to a context that was prepared again for the same
+        file, without sending the signals again.  The record belongs to
+        that context afterwards.
+        """
+        context.pub_date = self.pub_date
+        context.tags = self.tags
+        context._record = self
+        self._context = weakref.ref(context)
+
+    def get_context(self):
+        """Returns the context the record was created from if it is still
+        alive, otherwise a freshly prepared one.  No signals are sent for
+        the new context.
+        """
+        from rstblog.builder import Context
+        context = self._context and self._context()
+        if context is None:
+            config = self.builder.get_folder_config(
+                os.path.dirname(self.source_filename))
+            context = Context(self.builder, config, self.source_filename)
+            context.program.prepare()
+            context._record = self
+        return context
+
+    def render_summary(self):
+        return self.summary_html or ''
+
+    def render_contents(self, remember=True):
+        return self.builder.records.get_contents(self, remember)
+
+
+class RecordStore(object):
+    """Collects the records of a build and stores them in a file.  The
+    records of the previous build are available through :meth:`previous`
+    without preparing any file.
+
+    The store also keeps the contents of the files that were rendered for
+    records during the build, so that a file that shows up in many feeds
+    is only rendered once.
+    """
+
+    def __init__(self, builder, filename):
+        self.builder = builder
+        self.filename = filename
+        self.records = {}
+        self.contents = {}
+        self._previous = None
+
+    def reset(self):
+        self.records = {}
+        self.contents = {}
+
+    def add(self, record):
+        self.records[record.source_filename] = record
+
+    def get(self, source_filename):
+        return self.records.get(source_filename)
+
+    def get_contents(self, record, remember=True):
+        """Returns the rendered contents of the file of a record.  They
+        are rendered at most once per build unless `remember` is `False`,
+        which is meant for writers that go over every record once and
+        would otherwise keep all the contents in memory.
+        """
+        rv = self.contents.get(record.source_filename)
+        if rv is None:
+            rv = record.get_context().render_contents()
+            if remember:
+                self.contents[record.source_filename] = rv
+        return rv
+
+    def previous(self):
+        """Returns a dict of source filenames to the records of the last
+        build.  The records are bound to the builder.
+        """
+        if self._previous is None:
+            data = read_pickle(self.filename, {})
+            if data.get('version') != RECORDS_VERSION:
+                self._previous = {}
+            else:
+                self._previous = dict(
+                    (x.source_filename, x.bind(self.builder))
+                    for x in data['records'])
+        return self._previous
+
+    def save(self):
+        write_pickle(self.filename, {
+            'version':  RECORDS_VERSION,
+            'records':  list(self.records.values())
+        })
+        self._previous = dict(self.records)
+        self.contents = {}
@@ -12,19 +12,50 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import sys
+import threading
+import traceback
 import six.moves.urllib.request, six.moves.urllib.parse, six.moves.urllib.error
 import posixpath
 from six.moves.BaseHTTPServer import HTTPServer
+from six.moves.socketserver import ThreadingMixIn
 from six.moves.SimpleHTTPServer import SimpleHTTPRequestHandler
 
+from rstblog.watcher import make_watcher
+
 
 class SimpleRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    etag = None
+
+    def get_etag(self, path):
+        if os.path.isdir(path):
+            # folders requested without trailing slash get redirected
+            if not self.path.split('?', 1)[0].endswith('/'):
+                return None
+            path = os.path.join(path, 'index.html')
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return '"%x-%x"' % (int(stat.st_mtime * 1000000), stat.st_size)
+
+    def send_head(self):
+        self.server.build_watcher.wait_until_built()
+        self.etag = self.get_etag(self.translate_path(self.path))
+        if self.etag is not None:
+            if_none_match = self.headers.get('If-None-Match')
+            if if_none_match is not None and (if_none_match.strip() == '*' or
+               self.etag in [x.strip() for x in if_none_match.split(',')]):
+                self.send_response(304)
+                self.end_headers()
+                return None
+        return SimpleHTTPRequestHandler.send_head(self)
 
-    def do_GET(self):
-        if self.server.builder.anything_needs_build():
-            print('Detected change, building', file=sys.stderr)
-            self.server.builder.run()
-        SimpleHTTPRequestHandler.do_GET(self)
+    def end_headers(self):
+        if self.etag is not None:
+            self.send_header('ETag', self.etag)
+            self.send_header('Cache-Control', 'no-cache')
+        SimpleHTTPRequestHandler.end_headers(self)
 
     def translate_path(self, path):
         path = path.split('?', 1)[0].split('#', 1)[0]
@@ -50,8 +81,99 @@ class SimpleRequestHandler(SimpleHTTPRequestHandler):
         pass
 
 
-class Server(HTTPServer):
+class BuildWatcher(object):
+    """Rebuilds the project in a background thread whenever the watcher
+    reports changes.  Changes that come in while a build is running are
+    collected in the dirty set and picked up by the next build.  Requests
+    wait for a running build to finish so they never see a half built
+    project.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.dirty = set()
+        self.building = False
+        self.condition = threading.Condition()
+        self.watcher = make_watcher(builder.project_folder, self.is_ignored)
+        self.thread = threading.Thread(target=self.watch)
+        self.thread.daemon = True
+
+    def is_ignored(self, path):
+        """Changes are ignored unless they are to a file the builder reads.
+        Templates and config files are never ignored, other files are
+        checked against the ignore patterns of the folders they are in.
+        Files starting with a dot, like editor swap files or version
+        control folders, are always ignored.
+        """
+        builder = self.builder
+        for folder in (builder.default_output_folder, builder.cache_folder):
+            if path == folder or path.startswith(folder + os.path.sep):
+                return True
+        parts = os.path.relpath(path, builder.project_folder).split(os.path.sep)
+        if parts == [os.curdir]:
+            return False
+        if any(x.startswith('.') for x in parts):
+            return True
+        template_folder = os.path.join(builder.project_folder,
+                                       builder.config.root_get('template_path')
+                                       or builder.default_template_path)
+        if parts[-1] == 'config.yml' or path == template_folder or \
+           path.startswith(template_folder + os.path.sep):
+            return False
+        config = builder.config
+        folder = builder.project_folder
+        for part in parts:
+            if not builder.filter_files([part], config):
+                return True
+            folder = os.path.join(folder, part)
+            config_filename = os.path.join(folder, 'config.yml')
+            if os.path.isfile(config_filename):
+                with open(config_filename) as f:
+                    config = config.add_from_file(f)
+        return False
+
+    def start(self):
+        self.thread.start()
+
+    def build(self):
+        try:
+            self.builder.run()
+        except Exception:
+            traceback.print_exc()
+
+    def wait_until_built(self):
+        with self.condition:
+            while self.building:
+                self.condition.wait()
+
+    def watch(self):
+        while 1:
+            changes = self.watcher.wait()
+            with self.condition:
+                self.dirty.update(changes)
+                if not self.dirty:
+                    continue
+                changed = sorted(self.dirty)
+                self.dirty.clear()
+                self.building = True
+            try:
+                print('Detected change in %s, building' % ', '.join(
+                    os.path.relpath(x, self.builder.project_folder)
+                    for x in changed), file=sys.stderr)
+                self.build()
+            finally:
+                with self.condition:
+                    self.building = False
+                    self.condition.notify_all()
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
 
     def __init__(self, host, port, builder):
         HTTPServer.__init__(self, (host, int(port)), SimpleRequestHandler)
         self.builder = builder
+        self.build_watcher = BuildWatcher(builder)
+        if builder.anything_needs_build():
+            self.build_watcher.build()
+        self.build_watcher.start()
@@ -8,11 +8,115 @@
     :copyright: (c) 2010 by Armin Ronacher.
     :license: BSD, see LICENSE for more details.
 """
+from __future__ import with_statement
 from __future__ import absolute_import
-from blinker import Namespace
+import json
+import time
 
+from blinker import Namespace, NamedSignal
+import six
 
-signals = Namespace()
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def get_receiver_name(receiver):
+    """Returns a readable name for a signal receiver."""
+    module = getattr(receiver, '__module__', None)
+    name = getattr(receiver, '__qualname__', None) or \
+        getattr(receiver, '__name__', None) or repr(receiver)
+    if module:
+        return '%s.%s' % (module, name)
+    return name
+
+
+class SignalStats(object):
+    """Counts the calls of every signal receiver and how long they took.
+    The builder resets the stats when a build starts and dumps them when
+    it is done.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.receivers = {}
+
+    def reset(self):
+        self.receivers = {}
+
+    def record(self, signal, receiver, duration):
+        key = (signal.name, get_receiver_name(receiver))
+        item = self.receivers.get(key)
+        if item is None:
+            item = self.receivers[key] = [0, 0.0, 0.0]
+        item[0] += 1
+        item[1] += duration
+        if duration > item[2]:
+            item[2] = duration
+
+    def get_stats(self):
+        """Returns a list of dicts with the signal, the receiver, the
+        number of calls and the total and maximum time per call in seconds,
+        slowest receiver first.
+        """
+        rv = [{'signal': signal, 'receiver': receiver, 'calls': calls,
+               'total': total, 'max': max_time}
+              for (signal, receiver), (calls, total, max_time)
+              in six.iteritems(self.receivers)]
+        rv.sort(key=lambda x: -x['total'])
+        return rv
+
+    def format_report(self, limit=20):
+        stats = self.get_stats()
+        lines = ['Signal receivers:']
+        for item in stats[:limit]:
+            lines.append('  %10.3fs  %-50s %d calls, %.3fs max, %s' % (
+                item['total'], item['receiver'], item['calls'],
+                item['max'], item['signal']))
+        if len(stats) > limit:
+            lines.append('  ... %d more' % (len(stats) - limit))
+        return '\n'.join(lines)
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.get_stats(), f, indent=2, sort_keys=True)
+
+
+#: the call counts and timings of the receivers of all signals.
+signal_stats = SignalStats()
+
+
+class InstrumentedSignal(NamedSignal):
+    """A signal that records every call of its receivers in
+    :data:`signal_stats`.
+    """
+
+    def send(self, *sender, **kwargs):
+        if getattr(self, 'is_muted', False):
+            return []
+        sender = sender[0] if sender else None
+        return [(receiver, self.call_receiver(receiver, sender, **kwargs))
+                for receiver in self.receivers_for(sender)]
+
+    def call_receiver(self, receiver, sender, **kwargs):
+        if not signal_stats.enabled:
+            return receiver(sender, **kwargs)
+        start = timer()
+        try:
+            return receiver(sender, **kwargs)
+        finally:
+            signal_stats.record(self, receiver, timer() - start)
+
+
+class InstrumentedNamespace(Namespace):
+
+    def signal(self, name, doc=None):
+        try:
+            return self[name]
+        except KeyError:
+            return self.setdefault(name, InstrumentedSignal(name, doc))
+
+
+signals = InstrumentedNamespace()
 
 #: before the file is processed.  The context is already prepared and if
 #: the given program was able to extract configuration from the file, it
@@ -22,7 +126,8 @@ before_file_processed = signals.signal('before_file_processed')
 #: after the file was prepared
 after_file_prepared = signals.signal('after_file_prepared')
 
-#: after the file was published (public: yes)
+#: after the file was published (public: yes).  This is sent once per
+#: build for every published file, also in streamed builds.
 after_file_published = signals.signal('after_file_published')
 
 #: fired the moment before a template is rendered with the context object
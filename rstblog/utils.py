@@ -9,6 +9,12 @@
     :license: BSD, see LICENSE for more details.
 """
 from __future__ import absolute_import
+import os
+import re
+import errno
+import shutil
+import tempfile
+from fnmatch import translate
 from math import ceil
 
 from jinja2 import Markup
@@ -16,6 +22,183 @@ import six
 from six.moves import range
 
 
+# the umask cannot be read without setting it, so do that once on import.
+_umask = os.umask(0o022)
+os.umask(_umask)
+
+
+class OutputStats(object):
+    """Counts how many output files were written and how many were left
+    alone because their contents did not change.
+    """
+
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+
+    def reset(self):
+        self.written = self.skipped = 0
+
+    def __str__(self):
+        return '%d files written, %d unchanged' % (self.written, self.skipped)
+
+
+def files_equal(a, b):
+    """Checks if two files have the same contents.  A missing file is not
+    equal to anything.
+    """
+    try:
+        if os.path.getsize(a) != os.path.getsize(b):
+            return False
+        with open(a, 'rb') as fa:
+            with open(b, 'rb') as fb:
+                while 1:
+                    chunk = fa.read(65536)
+                    if chunk != fb.read(65536):
+                        return False
+                    if not chunk:
+                        return True
+    except (IOError, OSError):
+        return False
+
+
+def _replace_file(tmp_filename, filename, stats):
+    if files_equal(tmp_filename, filename):
+        os.remove(tmp_filename)
+        if stats is not None:
+            stats.skipped += 1
+        return False
+    os.rename(tmp_filename, filename)
+    if stats is not None:
+        stats.written += 1
+    return True
+
+
+def make_folder(folder):
+    """Creates a folder and its parents unless it exists.  Parallel builds
+    create folders from several processes at once, so losing the race to
+    another process is fine.
+    """
+    try:
+        os.makedirs(folder)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(folder):
+            raise
+
+
+def _make_temp_file(filename):
+    folder, basename = os.path.split(filename)
+    make_folder(folder)
+    return tempfile.mkstemp(dir=folder, prefix='.%s.' % basename)
+
+
+class OutputFile(object):
+    """A file opened for writing that writes to a temporary file next to
+    the target and only moves it into place when it is closed and the
+    contents changed.  That way readers never see half written files and
+    unchanged files keep their modification time.  If the block of a with
+    statement raises an exception the target is left alone.
+    """
+
+    def __init__(self, filename, mode='wb', stats=None):
+        fd, self.tmp_filename = _make_temp_file(filename)
+        # mkstemp creates files only readable by the owner
+        os.chmod(self.tmp_filename, 0o666 & ~_umask)
+        self.filename = filename
+        self.stats = stats
+        self.closed = False
+        self._file = os.fdopen(fd, mode)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def close(self):
+        """Closes the file and moves it into place.  Returns `True` if the
+        target was changed.
+        """
+        if self.closed:
+            return False
+        self.closed = True
+        self._file.close()
+        return _replace_file(self.tmp_filename, self.filename, self.stats)
+
+    def discard(self):
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+            os.remove(self.tmp_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def copy_file(source, destination, stats=None):
+    """Copies a file over like :func:`shutil.copy` but leaves the
+    destination alone if it already has the same contents.
+    """
+    if files_equal(source, destination):
+        if stats is not None:
+            stats.skipped += 1
+        return False
+    fd, tmp_filename = _make_temp_file(destination)
+    os.close(fd)
+    try:
+        shutil.copyfile(source, tmp_filename)
+        shutil.copymode(source, tmp_filename)
+    except:
+        os.remove(tmp_filename)
+        raise
+    os.rename(tmp_filename, destination)
+    if stats is not None:
+        stats.written += 1
+    return True
+
+
+class PatternMatcher(object):
+    """Matches filenames against a list of shell patterns like
+    :func:`fnmatch.fnmatch` but with all patterns combined into one regular
+    expression.  :meth:`match` returns the index of the first pattern that
+    matches or `None`, and the results are cached per filename.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._cache = {}
+        self._groups = ['rstblog_pattern_%d' % idx
+                        for idx in range(len(self.patterns))]
+        if self.patterns:
+            self._regex = re.compile('|'.join(
+                '(?P<%s>%s)' % (group, translate(os.path.normcase(pattern)))
+                for group, pattern in zip(self._groups, self.patterns)))
+        else:
+            self._regex = None
+
+    def match(self, filename):
+        try:
+            return self._cache[filename]
+        except KeyError:
+            pass
+        rv = None
+        if self._regex is not None:
+            m = self._regex.match(os.path.normcase(filename))
+            if m is not None:
+                for idx, group in enumerate(self._groups):
+                    if m.group(group) is not None:
+                        rv = idx
+                        break
+        self._cache[filename] = rv
+        return rv
+
+
 class Pagination(object):
     """Internal helper class for paginations"""
 
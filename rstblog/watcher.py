@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+    rstblog.watcher
+    ~~~~~~~~~~~~~~~
+
+    Watches the project folder for changes.  On Linux inotify is used
+    through ctypes, everywhere else the folder is polled.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import absolute_import
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_event_header = struct.Struct('iIII')
+
+
+class Watcher(object):
+    """Base class for watchers.  `ignore` is a function that is called
+    with absolute paths and returns `True` for files and folders that
+    should not be watched, like the output folder.
+    """
+
+    #: how long to wait for more events after the first one so that
+    #: editors writing several files end up in one batch.
+    settle_delay = 0.1
+
+    def __init__(self, folder, ignore=None):
+        self.folder = os.path.abspath(folder)
+        self.ignore = ignore or (lambda path: False)
+
+    def walk(self, folder=None):
+        for dirpath, dirnames, filenames in os.walk(folder or self.folder):
+            dirnames[:] = [x for x in dirnames
+                           if not self.ignore(os.path.join(dirpath, x))]
+            yield dirpath, filenames
+
+    def wait(self, timeout=None):
+        """Blocks until something changed or the timeout passed and
+        returns the set of changed paths.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """Checks the modification times of all files periodically."""
+
+    def __init__(self, folder, ignore=None, interval=1.0):
+        Watcher.__init__(self, folder, ignore)
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        rv = {}
+        for dirpath, filenames in self.walk():
+            for filename in filenames:
+                filename = os.path.join(dirpath, filename)
+                if self.ignore(filename):
+                    continue
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                rv[filename] = (stat.st_mtime, stat.st_size)
+        return rv
+
+    def wait(self, timeout=None):
+        started = time.time()
+        while 1:
+            snapshot = self.take_snapshot()
+            changed = set(k for k in set(snapshot) | set(self.snapshot)
+                          if snapshot.get(k) != self.snapshot.get(k))
+            self.snapshot = snapshot
+            if changed:
+                return changed
+            if timeout is not None and time.time() - started >= timeout:
+                return set()
+            time.sleep(self.interval)
+
+
+class InotifyWatcher(Watcher):
+    """Uses the inotify API of Linux.  Every folder gets a watch and
+    folders created later are added as they show up.
+    """
+
+    def __init__(self, folder, ignore=None):
+        Watcher.__init__(self, folder, ignore)
+        self.libc = get_libc()
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        self.add_tree(self.folder)
+
+    def add_tree(self, folder):
+        for dirpath, filenames in self.walk(folder):
+            self.add_watch(dirpath)
+
+    def add_watch(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, folder.encode(
+            sys.getfilesystemencoding()), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = folder
+
+    def read_events(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EINTR, errno.EAGAIN):
+                return changed
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                changed.add(self.folder)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            path = folder
+            if name:
+                path = os.path.join(folder, name.decode(
+                    sys.getfilesystemencoding()))
+            if self.ignore(path):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        changed = set()
+        while 1:
+            ready = select.select([self.fd], [], [], timeout)[0]
+            if not ready:
+                return changed
+            changed.update(self.read_events())
+            if changed:
+                timeout = self.settle_delay
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def get_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError(errno.ENOSYS, 'inotify is not supported')
+    return libc
+
+
+def make_watcher(folder, ignore=None):
+    """Returns the best watcher for this platform."""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folder, ignore)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folder, ignore)